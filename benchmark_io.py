@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""benchmark_io.py times the streaming tools with and without threaded I/O
+against slow (network-mounted) storage stand-ins.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import sys
+import time
+try:
+    from StringIO import StringIO  # Python 2
+except ImportError:
+    from io import StringIO
+from commonIO import CustomParser
+from commonIO import read_lines
+from commonIO import BackgroundWriter
+from generate_test_data import SyntheticData
+import extract_5prime_most_base
+import keep_sequence_range
+
+
+class SlowFile(object):
+    """In-memory file that sleeps on every read and write call to mimic storage latency."""
+    def __init__(self, contents='', latency=0.001):
+        self.data = StringIO(contents)
+        self.latency = latency
+
+    def read(self, size=-1):
+        time.sleep(self.latency)
+        return self.data.read(size)
+
+    def readline(self):
+        return self.data.readline()
+
+    def write(self, string):
+        time.sleep(self.latency)
+        self.data.write(string)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def time_call(function, *args):
+    """Return the wall-clock seconds taken by function(*args)."""
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def run_extract(sam, latency, queue_depth):
+    """Run extract_5prime_most_base between slow files, writing through stdout's code path."""
+    source = SlowFile(sam, latency)
+    sink = SlowFile('', latency)
+    saved_stdout = sys.stdout
+    sys.stdout = sink
+    try:
+        extract_5prime_most_base.extract_5prime_most_base(source, True, None, queue_depth)
+    finally:
+        sys.stdout = saved_stdout
+
+
+def run_keep_range(fastq, latency, queue_depth):
+    """Run keep_sequence_range between slow files."""
+    source = SlowFile(fastq, latency)
+    sink = SlowFile('', latency)
+    keep_sequence_range.write_sequence_range(source, sink, 16, 35, keep_sequence_range.CHUNK, queue_depth)
+
+
+def run_line_reader(sam, latency, queue_depth):
+    """Read and rewrite every line, isolating the cost of the I/O layer."""
+    source = SlowFile(sam, latency)
+    sink = SlowFile('', latency)
+    with BackgroundWriter(sink, queue_depth) as writer:
+        for line in read_lines(source, 4096, queue_depth):
+            writer.write(line + '\n')
+
+
+def get_arguments():
+    """Command-line interface for benchmark_io.py"""
+    parser = CustomParser(
+        description='''benchmark_io.py times the streaming tools with and without threaded I/O
+against slow (network-mounted) storage stand-ins.
+
+Copyright (C) 2015 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument('--reads',
+                        help='number of synthetic reads per run, default = 50000',
+                        metavar='N',
+                        type=int,
+                        default=50000)
+    parser.add_argument('--latency',
+                        help='seconds slept per read/write call of the storage stand-in, default = 0.002',
+                        metavar='SECONDS',
+                        type=float,
+                        default=0.002)
+    parser.add_argument('--queue_depths',
+                        help='queue depths to compare (0 is the unthreaded baseline), default = 0 2 8 32',
+                        metavar='BLOCKS',
+                        type=int,
+                        nargs='+',
+                        default=[0, 2, 8, 32])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    sam = '\n'.join(SyntheticData().sam_alignments(args.reads)) + '\n'
+    fastq = '\n'.join(SyntheticData().fastq_reads(args.reads)) + '\n'
+    benchmarks = [('read/write lines', run_line_reader, sam),
+                  ('extract_5prime_most_base', run_extract, sam),
+                  ('keep_sequence_range', run_keep_range, fastq)]
+    sys.stdout.write('benchmark\tqueue_depth\tseconds\tspeedup\n')
+    for (name, function, data) in benchmarks:
+        baseline = None
+        for queue_depth in args.queue_depths:
+            seconds = time_call(function, data, args.latency, queue_depth)
+            if baseline is None:
+                baseline = seconds
+            sys.stdout.write('{}\t{}\t{:.3f}\t{:.2f}\n'.format(name, queue_depth, seconds, baseline / seconds))
+            sys.stdout.flush()
@@ -0,0 +1,402 @@
+#!/usr/bin/python
+"""benchmark_tools.py times each SequenceTools tool end to end and its core
+functions on seeded synthetic data, saving the results as JSON and comparing
+them against a saved baseline.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    from StringIO import StringIO  # Python 2
+except ImportError:
+    from io import StringIO
+from commonIO import CustomParser
+from commonIO import read_chunk
+from generate_test_data import write_test_data
+import create_alignment_db
+import create_cluster_files
+import extract_5prime_most_base
+import keep_sequence_range
+import parse_bowtie_output
+import records
+import sequencetools
+
+TOOL_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPEATS = 3  # runs per benchmark; the fastest is reported
+TOLERANCE = 0.1  # fractional slowdown against the baseline reported as a regression
+MINIMUM_DELTA = 0.05  # seconds; smaller slowdowns are timer noise, never regressions
+BATCH_FILES = 20  # small input files run one process each vs. one sequencetools batch
+SECTIONS = ('tools', 'functions', 'startup')
+GATED_SECTIONS = ('tools', 'functions')  # startup is compared but too noisy to fail a run
+
+
+def tool_commands(files):
+    """Return (name, command, stdin filename, record count filename, record lines) for each tool."""
+    python = sys.executable
+
+    def script(name):
+        return os.path.join(TOOL_DIRECTORY, name)
+
+    return [('create_alignment_db',
+             [python, script('create_alignment_db.py'), '-i', files['SAM'], '-l', 'bench', '-d', 'bench'],
+             None, files['SAM'], 1),
+            ('create_cluster_files',
+             [python, script('create_cluster_files.py'), '-i', files['LOCI'], '-l', 'bench', '-d', 'bench'],
+             None, files['LOCI'], 1),
+            ('extract_5prime_most_base',
+             [python, script('extract_5prime_most_base.py'), '-i', files['SAM']],
+             None, files['SAM'], 1),
+            ('keep_sequence_range',
+             [python, script('keep_sequence_range.py'), '-i', files['FASTQ']],
+             None, files['FASTQ'], 4),
+            ('split_by_position',
+             [python, script('split_by_position.py')],
+             files['BED'], files['BED'], 1),
+            ('add_multimapping_tally',
+             [python, script('parse_bowtie_output.py')],
+             files['SAM_ALIGNMENTS'], files['SAM_ALIGNMENTS'], 1)]
+
+
+def count_records(filename, lines_per_record):
+    """Return the number of non-header records and the size in bytes of filename."""
+    lines = 0
+    with open(filename) as input_file:
+        for line in input_file:
+            if line[0] != '@' or lines_per_record > 1:
+                lines += 1
+    return lines // lines_per_record, os.path.getsize(filename)
+
+
+def run_tool(command, stdin_filename, working_directory):
+    """Run command in working_directory, returning (seconds, peak memory in kB)."""
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = TOOL_DIRECTORY
+    with open(os.devnull, 'w') as devnull:
+        if stdin_filename is None:
+            stdin = None
+        else:
+            stdin = open(stdin_filename)
+        try:
+            start = time.time()
+            process = subprocess.Popen(command, stdin=stdin, stdout=devnull, stderr=devnull,
+                                       cwd=working_directory, env=environment)
+            (_, status, usage) = os.wait4(process.pid, 0)
+            seconds = time.time() - start
+            process.returncode = status
+        finally:
+            if stdin is not None:
+                stdin.close()
+    if status != 0:
+        raise RuntimeError('Benchmark command failed ({}): {}'.format(status, ' '.join(command)))
+    return seconds, usage.ru_maxrss
+
+
+def benchmark_tools(files, repeats=REPEATS):
+    """Time each tool end to end; returns a dictionary of results by tool name."""
+    results = {}
+    for (name, command, stdin_filename, records_filename, lines_per_record) in tool_commands(files):
+        (records, size) = count_records(records_filename, lines_per_record)
+        best_seconds = None
+        peak_memory = 0
+        for _ in range(repeats):
+            working_directory = tempfile.mkdtemp(prefix='benchmark_{}_'.format(name))
+            try:
+                (seconds, memory) = run_tool(command, stdin_filename, working_directory)
+            finally:
+                shutil.rmtree(working_directory)
+            if best_seconds is None or seconds < best_seconds:
+                best_seconds = seconds
+            peak_memory = max(peak_memory, memory)
+        results[name] = {'seconds': best_seconds,
+                         'records': records,
+                         'records_per_second': records / best_seconds,
+                         'megabytes_per_second': size / 1048576.0 / best_seconds,
+                         'peak_memory_kb': peak_memory}
+        sys.stderr.write('{}: {:.3f} s\n'.format(name, best_seconds))
+        sys.stderr.flush()
+    return results
+
+
+def function_benchmarks(files):
+    """Return (name, function, records) for the core functions of each tool.
+
+    Each function processes its whole input in memory when called."""
+    with open(files['SAM']) as sam_file:
+        sam = [line.rstrip('\n') for line in sam_file if line[0] != '@']
+    with open(files['BED']) as bed_file:
+        bed_data = bed_file.read()
+    with open(files['LOCI']) as loci_file:
+        loci_fields = [line.rstrip('\n').split('\t')[3] for line in loci_file]
+    loci = [field.split(';') for field in loci_fields]
+    with open(files['FASTQ']) as fastq_file:
+        fastq = fastq_file.read()
+    mapped_sam = [line for line in sam if (int(line.split('\t')[1]) & 0x4) == 0]
+    optional_fields = [line.split('\t')[11:] for line in mapped_sam]
+    sequences = [line.split('\t')[9] for line in mapped_sam]
+    cigars = [(line.split('\t')[5], int(line.split('\t')[3]) - 1, len(line.split('\t')[9]))
+              for line in mapped_sam]
+
+    def read_all_lines():
+        for _ in read_chunk(StringIO(bed_data), extract_5prime_most_base.CHUNK_SIZE):
+            pass
+
+    def parse_alignments():
+        for line in sam:
+            create_alignment_db.parse_alignment(line)
+
+    def get_mismatches():
+        for fields in optional_fields:
+            records.get_mismatches(fields)
+
+    def reverse_complements():
+        for sequence in sequences:
+            create_alignment_db.reverse_complement(sequence)
+
+    def create_reads():
+        for line in mapped_sam:
+            extract_5prime_most_base.Read(line)
+
+    def parse_cigars():
+        for (cigar, start, length) in cigars:
+            extract_5prime_most_base.Read.parse_cigar_string(cigar, start, length)
+
+    reads = [extract_5prime_most_base.Read(line) for line in mapped_sam]
+
+    def format_first_bases():
+        extract_5prime_most_base.BEDBatchWriter(None).format_batch(reads)
+
+    def unique_tags():
+        for tags in loci:
+            create_cluster_files.get_unique_tags(tags)
+
+    with open(files['LOCI']) as loci_file:
+        loci_data = loci_file.read()
+
+    def read_loci():
+        for (_, tags) in create_cluster_files.LociReader(StringIO(loci_data), create_cluster_files.CHUNK):
+            for _ in create_cluster_files.get_unique_tags(tags):
+                pass
+
+    def keep_range():
+        for _ in keep_sequence_range.keep_sequence_range(StringIO(fastq), 16, 35, keep_sequence_range.CHUNK):
+            pass
+
+    def tally_multimappers():
+        for _ in parse_bowtie_output.add_multimapping_tally(StringIO('\n'.join(sam) + '\n')):
+            pass
+
+    return [('commonIO.read_chunk', read_all_lines, bed_data.count('\n')),
+            ('create_alignment_db.parse_alignment', parse_alignments, len(sam)),
+            ('records.get_mismatches', get_mismatches, len(optional_fields)),
+            ('create_alignment_db.reverse_complement', reverse_complements, len(sequences)),
+            ('extract_5prime_most_base.Read', create_reads, len(mapped_sam)),
+            ('extract_5prime_most_base.Read.parse_cigar_string', parse_cigars, len(cigars)),
+            ('extract_5prime_most_base.BEDBatchWriter.format_batch', format_first_bases, len(reads)),
+            ('create_cluster_files.get_unique_tags', unique_tags, len(loci)),
+            ('create_cluster_files.LociReader', read_loci, len(loci_fields)),
+            ('keep_sequence_range.keep_sequence_range', keep_range, fastq.count('\n') // 4),
+            ('parse_bowtie_output.add_multimapping_tally', tally_multimappers, len(sam))]
+
+
+def benchmark_functions(files, repeats=REPEATS):
+    """Time the core functions in this process; returns a dictionary of results by function name."""
+    results = {}
+    for (name, function, records) in function_benchmarks(files):
+        best_seconds = None
+        for _ in range(repeats):
+            start = time.time()
+            function()
+            seconds = time.time() - start
+            if best_seconds is None or seconds < best_seconds:
+                best_seconds = seconds
+        results[name] = {'seconds': best_seconds,
+                         'records': records,
+                         'records_per_second': records / max(best_seconds, 1e-9)}
+    return results
+
+
+def time_command(command, working_directory=TOOL_DIRECTORY, repeats=REPEATS):
+    """Return the fastest wall-clock seconds of running command."""
+    return min(run_tool(command, None, working_directory)[0] for _ in range(repeats))
+
+
+def benchmark_startup(files, repeats=REPEATS):
+    """Time module imports in a fresh interpreter, and many small files run as
+    separate processes vs. one sequencetools batch; returns results by name."""
+    python = sys.executable
+    results = {}
+    interpreter = time_command([python, '-c', 'pass'], repeats=repeats)
+    results['python startup'] = {'seconds': interpreter}
+    for module in ['sequencetools', 'chromosomes', 'commonIO'] + sorted(sequencetools.COMMANDS.values()):
+        seconds = time_command([python, '-c', 'import {}'.format(module)], repeats=repeats)
+        results['import {}'.format(module)] = {'seconds': seconds,
+                                                'import_seconds': max(seconds - interpreter, 0.0)}
+
+    working_directory = tempfile.mkdtemp(prefix='benchmark_batch_')
+    try:
+        with open(files['SAM_ALIGNMENTS']) as sam_file:
+            alignments = sam_file.readlines()
+        per_file = max(1, len(alignments) // BATCH_FILES // 10)
+        inputs = []
+        for index in range(BATCH_FILES):
+            filename = os.path.join(working_directory, 'bin_{}.sam'.format(index))
+            with open(filename, 'w') as bin_file:
+                bin_file.writelines(alignments[index * per_file:(index + 1) * per_file])
+            inputs.append(filename)
+        manifest = os.path.join(working_directory, 'manifest')
+
+        def clean_outputs():
+            for filename in inputs:
+                if os.path.exists(filename + '.bed'):
+                    os.remove(filename + '.bed')
+
+        separate = None
+        batch = None
+        for _ in range(repeats):
+            clean_outputs()
+            start = time.time()
+            for filename in inputs:
+                run_tool([python, os.path.join(TOOL_DIRECTORY, 'extract_5prime_most_base.py'),
+                          '-i', filename, '-o', filename + '.bed'], None, working_directory)
+            seconds = time.time() - start
+            separate = seconds if separate is None else min(separate, seconds)
+
+            clean_outputs()
+            with open(manifest, 'w') as manifest_file:
+                for filename in inputs:
+                    manifest_file.write('extract5p -i {0} -o {0}.bed\n'.format(filename))
+            (seconds, _) = run_tool([python, os.path.join(TOOL_DIRECTORY, 'sequencetools.py'), 'batch', manifest],
+                                    None, working_directory)
+            batch = seconds if batch is None else min(batch, seconds)
+    finally:
+        shutil.rmtree(working_directory)
+    results['{} files as separate processes'.format(BATCH_FILES)] = {'seconds': separate}
+    results['{} files in one batch'.format(BATCH_FILES)] = {'seconds': batch,
+                                                            'speedup_over_separate': separate / batch}
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE, minimum_delta=MINIMUM_DELTA):
+    """Add baseline timings and speedups to results; return the names of regressed benchmarks.
+
+    A benchmark in GATED_SECTIONS regresses when it is both more than tolerance
+    slower (fractionally) and more than minimum_delta seconds slower than the baseline."""
+    regressions = []
+    for section in SECTIONS:
+        for (name, result) in results[section].items():
+            try:
+                baseline_seconds = baseline[section][name]['seconds']
+            except KeyError:
+                continue
+            result['baseline_seconds'] = baseline_seconds
+            result['speedup'] = baseline_seconds / max(result['seconds'], 1e-9)
+            if (section in GATED_SECTIONS and result['speedup'] < 1 - tolerance and
+                    result['seconds'] - baseline_seconds > minimum_delta):
+                regressions.append(name)
+    return sorted(regressions)
+
+
+def get_arguments():
+    """Command-line interface for benchmark_tools.py"""
+    parser = CustomParser(
+        description='''benchmark_tools.py times each SequenceTools tool end to end and its core
+functions on seeded synthetic data, saving the results as JSON and comparing
+them against a saved baseline.
+
+Copyright (C) 2015 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument('-n', '--reads',
+                        help='number of synthetic reads, default = 100000',
+                        metavar='N',
+                        type=int,
+                        default=100000)
+    parser.add_argument('-c', '--clusters',
+                        help='number of synthetic merged loci, default = 10000',
+                        metavar='N',
+                        type=int,
+                        default=10000)
+    parser.add_argument('-s', '--seed',
+                        help='random seed for the synthetic data, default = 1',
+                        metavar='SEED',
+                        type=int,
+                        default=1)
+    parser.add_argument('-r', '--repeats',
+                        help='runs per benchmark, the fastest is kept; default = {}'.format(REPEATS),
+                        metavar='N',
+                        type=int,
+                        default=REPEATS)
+    parser.add_argument('-o', '--output',
+                        help='JSON file for results, default = benchmark_results.json',
+                        metavar='JSON',
+                        default='benchmark_results.json')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON results of an earlier run to compare against',
+                        metavar='JSON')
+    parser.add_argument('--tolerance',
+                        help='fractional slowdown reported as a regression, default = {}'.format(TOLERANCE),
+                        metavar='FRACTION',
+                        type=float,
+                        default=TOLERANCE)
+    parser.add_argument('--minimum_delta',
+                        help='slowdown in seconds below which no regression is reported, '
+                             'default = {}'.format(MINIMUM_DELTA),
+                        metavar='SECONDS',
+                        type=float,
+                        default=MINIMUM_DELTA)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    data_directory = tempfile.mkdtemp(prefix='benchmark_data_')
+    try:
+        data_files = write_test_data(os.path.join(data_directory, 'synthetic'), args.reads, args.clusters, args.seed)
+        data_files['SAM_ALIGNMENTS'] = os.path.join(data_directory, 'synthetic_alignments.sam')
+        with open(data_files['SAM']) as sam_file, open(data_files['SAM_ALIGNMENTS'], 'w') as alignments_file:
+            for sam_line in sam_file:
+                if sam_line[0] != '@':
+                    alignments_file.write(sam_line)
+        benchmark_results = {'python': platform.python_version(),
+                             'reads': args.reads,
+                             'clusters': args.clusters,
+                             'seed': args.seed,
+                             'tools': benchmark_tools(data_files, args.repeats),
+                             'functions': benchmark_functions(data_files, args.repeats),
+                             'startup': benchmark_startup(data_files, args.repeats)}
+    finally:
+        shutil.rmtree(data_directory)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            benchmark_results['regressions'] = compare_to_baseline(benchmark_results, json.load(baseline_file),
+                                                                   args.tolerance, args.minimum_delta)
+    with open(args.output, 'w') as output_file:
+        json.dump(benchmark_results, output_file, indent=2, sort_keys=True)
+
+    for section in SECTIONS:
+        for (result_name, result) in sorted(benchmark_results[section].items()):
+            sys.stdout.write('{}\t{:.4f} s{}{}\n'.format(
+                result_name, result['seconds'],
+                '\t{:.0f} records/s'.format(result['records_per_second']) if 'records_per_second' in result else '',
+                '\t{:.2f}x baseline'.format(result['speedup']) if 'speedup' in result else ''))
+    if benchmark_results.get('regressions'):
+        sys.stdout.write('Regressions: {}\n'.format(', '.join(benchmark_results['regressions'])))
+        sys.exit(1)
@@ -0,0 +1,155 @@
+"""chromosomes.py contains a chromosome dictionary shared by the SequenceTools
+scripts: compact integer IDs for chromosome names plus interned name and
+strand strings, persisted as {prefix}_chromosomes.data.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import os
+
+STRANDS = {"+": "+", "-": "-", ".": "."}  # one shared string object per strand
+
+
+def intern_strand(strand):
+    """Return the shared string for a strand (+, - or .)."""
+    return STRANDS.get(strand, strand)
+
+
+def chromosome_filename(database_prefix):
+    """Return the flat file name of the chromosome dictionary for a database prefix."""
+    return "{}_chromosomes.data".format(database_prefix)
+
+
+class ChromosomeDictionary(object):
+    """Assigns compact integer IDs (0, 1, 2...) to chromosome names in order of first
+    appearance and hands out one shared string per chromosome name.
+
+    Flat file format ({prefix}_chromosomes.data):
+        ID (0-based integer),
+        Chromosome name,
+        Length in bases (0 if unknown)
+
+    Tools load the file for a prefix, extend it and save it back only if they
+    added chromosomes (see write); run jobs that add new chromosomes to the
+    same prefix one at a time."""
+    def __init__(self):
+        self.ids = {}  # name -> ID
+        self.names = []  # ID -> name
+        self.lengths = []  # ID -> length (0 if unknown)
+        self.modified = False  # changed since it was last read or written
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def add(self, name, length=0):
+        """Return the ID of a chromosome, adding it if it is new."""
+        try:
+            chromosome_id = self.ids[name]
+        except KeyError:
+            chromosome_id = len(self.names)
+            self.ids[name] = chromosome_id
+            self.names.append(name)
+            self.lengths.append(length)
+            self.modified = True
+        else:
+            if length and not self.lengths[chromosome_id]:
+                self.lengths[chromosome_id] = length
+                self.modified = True
+        return chromosome_id
+
+    def intern(self, name):
+        """Return the shared string for a chromosome name, adding it if it is new."""
+        try:
+            return self.names[self.ids[name]]
+        except KeyError:
+            return self.names[self.add(name)]
+
+    def add_sam_header(self, header_line):
+        """Add the chromosome of a SAM @SQ header line; other header lines are ignored.
+
+        header_line may be str or bytes; the name is added as the same type.
+        Returns the chromosome ID or None."""
+        if isinstance(header_line, bytes):
+            (sequence_header, name_tag, length_tag, newline, tab) = (b"@SQ", b"SN:", b"LN:", b"\n", b"\t")
+        else:
+            (sequence_header, name_tag, length_tag, newline, tab) = ("@SQ", "SN:", "LN:", "\n", "\t")
+        if not header_line.startswith(sequence_header):
+            return None
+        name = None
+        length = 0
+        for field in header_line.rstrip(newline).split(tab)[1:]:
+            if field.startswith(name_tag):
+                name = field[3:]
+            elif field.startswith(length_tag):
+                length = int(field[3:])
+        if name is None:
+            return None
+        return self.add(name, length)
+
+    def write(self, filename):
+        """Write the dictionary to a flat file, replacing any existing file.
+
+        The file is written under a temporary name and renamed into place, so
+        other processes never read a partly written file. Concurrent writers
+        are not merged: the last to finish replaces the file, dropping any
+        chromosomes that only the others added."""
+        temporary_filename = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            with open(temporary_filename, "w") as output:
+                for (chromosome_id, name) in enumerate(self.names):
+                    output.write("{}\t{}\t{}\n".format(chromosome_id, name, self.lengths[chromosome_id]))
+            os.rename(temporary_filename, filename)
+            self.modified = False
+        except Exception:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+        return True
+
+    def save(self, database_prefix):
+        """Write the dictionary to {prefix}_chromosomes.data unless it is unchanged since loading."""
+        filename = chromosome_filename(database_prefix)
+        if self.modified or not os.path.exists(filename):
+            return self.write(filename)
+        return False
+
+    @classmethod
+    def read(cls, filename):
+        """Return a dictionary read from a flat file written by write()."""
+        chromosomes = cls()
+        with open(filename) as input_file:
+            for line in input_file:
+                (chromosome_id, name, length) = line.rstrip("\n").split("\t")
+                if int(chromosome_id) != chromosomes.add(name, int(length)):
+                    raise ValueError("Chromosome IDs out of order in {}: {}".format(filename, line.strip()))
+        chromosomes.modified = False
+        return chromosomes
+
+    @classmethod
+    def load(cls, database_prefix):
+        """Return the dictionary saved for database_prefix, or an empty one if none exists."""
+        filename = chromosome_filename(database_prefix)
+        if os.path.exists(filename):
+            return cls.read(filename)
+        else:
+            return cls()
@@ -3,30 +3,148 @@ __author__ = 'joy-el'
 
 import sys
 import argparse
+import threading
+try:
+    import Queue as queue  # Python 2
+except ImportError:
+    import queue
+
+QUEUE_DEPTH = 8  # blocks held between the I/O threads and the parse loop; 0 disables threading
+WRITE_BUFFER = 65536  # bytes of output collected before handing a batch to the writer
+PREFETCH_SIZE = 1048576  # bytes per block read by the prefetch thread
+
+
+def newline_for(chunk):
+    """Return the newline matching a chunk read in text (str) or binary (bytes) mode."""
+    if isinstance(chunk, bytes):
+        return b"\n"
+    else:
+        return "\n"
+
+
+def split_blocks(blocks):
+    """Yield the lines in an iterable of str or bytes blocks.
+
+    A line spanning several blocks is collected as a list of pieces and joined
+    once, so reading a long line takes time linear in its length. A final line
+    without a trailing newline is also returned."""
+    newline = None
+    pieces = []  # the incomplete line at the end of the blocks read so far
+    for block in blocks:
+        if newline is None:
+            newline = newline_for(block)
+        lines = block.split(newline)
+        if len(lines) == 1:
+            pieces.append(block)
+            continue
+        if pieces:
+            pieces.append(lines[0])
+            lines[0] = block[:0].join(pieces)
+        for line in lines[:-1]:
+            yield line
+        pieces = [lines[-1]]
+    if pieces:
+        line = pieces[0][:0].join(pieces)
+        if line:
+            yield line
+
+
+def read_blocks(open_file_object, chunk_size=1048):
+    """Yield chunk_size blocks of a file until EOF."""
+    block = open_file_object.read(chunk_size)
+    while block:
+        yield block
+        block = open_file_object.read(chunk_size)
 
 
 def read_chunk(open_file_object, chunk_size=1048):
-    """Read in file by chunk_size chunks returning one line at a time."""
-    # get first chunk
-    chunk = open_file_object.read(chunk_size)
-    # continue looping until a chunk is just EOF (empty line)
-    while chunk:
-        chunk_list = chunk.split("\n")
-        # yield all but last, potentially incomplete line
-        for c in chunk_list[:-1]:
-            yield c
-        # add incomplete line to beginning of next chunk read
-        chunk = chunk_list[-1] + open_file_object.read(chunk_size)
-
-
-def read_fastq_chunk(fastq_file, chunk_size=1048):
+    """Read in file by chunk_size chunks returning one line at a time.
+
+    Works on files opened in text or binary mode; lines are str or bytes to match."""
+    return split_blocks(read_blocks(open_file_object, chunk_size))
+
+
+def _put_unless_stopped(block_queue, item, stop):
+    """Put item on block_queue, giving up once stop is set; returns True if it was queued."""
+    while not stop.is_set():
+        try:
+            block_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _fill_block_queue(open_file_object, chunk_size, block_queue, stop):
+    """Reader thread: put chunk_size blocks on block_queue, then "" at EOF.
+
+    Quits without reading further once stop is set."""
+    try:
+        block = open_file_object.read(chunk_size)
+        while block:
+            if not _put_unless_stopped(block_queue, block, stop):
+                return
+            block = open_file_object.read(chunk_size)
+    except Exception as error:
+        _put_unless_stopped(block_queue, error, stop)
+    else:
+        _put_unless_stopped(block_queue, "", stop)
+
+
+def prefetch_blocks(open_file_object, chunk_size=1048, queue_depth=QUEUE_DEPTH):
+    """Yield chunk_size blocks of a file that are read ahead by a background thread.
+
+    At most queue_depth blocks wait in memory; errors raised by the reader
+    thread are re-raised here. If the caller stops early (an exception or
+    closing the generator) the reader thread is told to stop and its queued
+    blocks are dropped."""
+    block_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    reader = threading.Thread(target=_fill_block_queue,
+                              args=(open_file_object, chunk_size, block_queue, stop))
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            block = block_queue.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            yield block
+    finally:
+        stop.set()
+        try:
+            while True:
+                block_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def read_chunk_prefetch(open_file_object, chunk_size=1048, queue_depth=QUEUE_DEPTH):
+    """Return one line at a time like read_chunk while a reader thread prefetches blocks."""
+    return split_blocks(prefetch_blocks(open_file_object, chunk_size, queue_depth))
+
+
+def read_lines(open_file_object, chunk_size=1048, queue_depth=QUEUE_DEPTH, prefetch_size=PREFETCH_SIZE):
+    """Return one line at a time, prefetching in a thread unless queue_depth is 0.
+
+    The prefetch thread reads prefetch_size blocks, so each queue handoff moves
+    a large block; chunk_size is used when reading without the thread."""
+    if queue_depth > 0:
+        return read_chunk_prefetch(open_file_object, prefetch_size, queue_depth)
+    else:
+        return read_chunk(open_file_object, chunk_size)
+
+
+def read_fastq_chunk(fastq_file, chunk_size=1048, queue_depth=0):
     """Return a tuple representing a fastq read
 
     DOES NOT WORK WITH MULTI-LINE SEQUENCE FASTQ FILES!!"""
     ##TODO handle comment lines
     ##TODO handle multi-line DNA sequence
     read = []
-    for line in read_chunk(fastq_file, chunk_size):
+    for line in read_lines(fastq_file, chunk_size, queue_depth):
         read.append(line)
         if len(read) > 4:
             yield read[0:4]
@@ -34,6 +152,89 @@ def read_fastq_chunk(fastq_file, chunk_size=1048):
     yield read[0:4]
 
 
+class BackgroundWriter(object):
+    """Write to an open file from a background thread.
+
+    Strings (str or bytes, not mixed) given to write() are collected into batches of about buffer_size
+    bytes and up to queue_depth batches are queued for the writer thread, so
+    the caller can keep parsing while output is flushed. With a queue_depth of
+    0 batches are written directly by the caller. The file is not closed;
+    call close() (or use as a context manager) to flush remaining output."""
+    def __init__(self, open_file_object, queue_depth=QUEUE_DEPTH, buffer_size=WRITE_BUFFER):
+        self.output = open_file_object
+        self.buffer_size = buffer_size
+        self.error = None
+        self._buffer = []
+        self._buffered = 0
+        if queue_depth > 0:
+            self._queue = queue.Queue(maxsize=queue_depth)
+            self._thread = threading.Thread(target=self._drain)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._queue = None
+            self._thread = None
+
+    def _drain(self):
+        """Writer thread: write queued batches until None is received."""
+        batch = self._queue.get()
+        while batch is not None:
+            if self.error is None:
+                try:
+                    self.output.write(batch)
+                except Exception as error:
+                    self.error = error
+            batch = self._queue.get()
+
+    def _send(self, batch):
+        if self.error is not None:
+            raise self.error
+        if self._queue is None:
+            self.output.write(batch)
+        else:
+            self._queue.put(batch)
+
+    def write(self, string):
+        """Buffer string for output, handing off a batch once buffer_size is reached."""
+        self._buffer.append(string)
+        self._buffered += len(string)
+        if self._buffered >= self.buffer_size:
+            self._send(self._buffer[0][:0].join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        """Write any buffered output and wait for the writer thread to finish."""
+        try:
+            if self._buffer:
+                self._send(self._buffer[0][:0].join(self._buffer))
+        finally:
+            self._buffer = []
+            self._buffered = 0
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+        if self.error is not None:
+            raise self.error
+        self.output.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep the output written before the error, without masking the error;
+            # buffered output is only lost if the writer itself has failed
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
+
+
 class CustomParser(argparse.ArgumentParser):
     """Custom command line argument parser inheriting from argparse.
 
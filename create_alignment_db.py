@@ -19,16 +19,20 @@ Copyright (C) 2014 Joy-El R.B. Talbot
 
 __author__ = 'Joy-El R.B. Talbot'
 
-from commonIO import read_chunk
+from commonIO import read_lines
 from commonIO import CustomParser
+from commonIO import BackgroundWriter
+from commonIO import QUEUE_DEPTH
+from chromosomes import ChromosomeDictionary
+from records import get_mismatches
 import datetime
 import sys
-import re
 
 CHUNK = 4096  # bytes of input read per IO call with read_chunk
+MISMATCH_BINS = 3  # mismatch columns in the tags file; the last bin also counts any higher mismatch counts
 
 
-def get_commandline_args():
+def get_commandline_args(argv=None):
     """Command-line interface for create_alignment_db.py"""
     parser = CustomParser(
         description='''create_alignment_db.py creates a set of SQLite3 databases from
@@ -49,7 +53,22 @@ Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License versi
                         metavar="NAME",
                         type=str,
                         default=datetime.datetime.now().strftime('%y%m%d-%H%M%S'))
-    arguments = parser.parse_args()
+    parser.add_argument("--mismatch_bins",
+                        help="number of mismatch columns (0, 1, ... N-1 or more) in the tags file; "
+                             "default = {}".format(MISMATCH_BINS),
+                        metavar="N",
+                        type=int,
+                        default=MISMATCH_BINS)
+    parser.add_argument("--queue_depth",
+                        help="blocks buffered between the I/O threads and parsing, 0 disables threaded I/O; "
+                             "default = {}".format(QUEUE_DEPTH),
+                        metavar="BLOCKS",
+                        type=int,
+                        default=QUEUE_DEPTH)
+    arguments = parser.parse_args(argv)
+
+    if arguments.mismatch_bins < 1:
+        parser.error("--mismatch_bins must be at least 1")
 
     if arguments.input is None:
         use_stdin = True
@@ -61,37 +80,21 @@ Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License versi
     return (arguments, use_stdin)
 
 
-def write_data(string, filename):
-    """Write string to file."""
-    with open(filename, "a") as output:
-        output.write(string + "\n")
-    return True
-
-
-def get_mismatches(flags):
-    """Return number of mismatches from MD flag. See SAM format for details."""
-    for flag in flags:
-        try:
-            MD_flag = re.search("MD:Z:([ATCGNatcgn0-9]+)", flag).groups()[0]
-        except AttributeError:
-            next
-        else:
-            return len(re.split("[ATCGNatcgn]+", MD_flag))-1
-
-
 def reverse_complement(sequence):
     """Return the reverse complement of a DNA sequence"""
     complement = {"A":"T", "T":"A", "G":"C", "C":"G", "N":"N",
                   "a":"T", "t":"A", "g":"C", "c":"G", "n":"N"}  # to account for case
     # creates the complement as a list
-    complement_sequence = map(lambda x: complement[x], sequence)
+    complement_sequence = [complement[x] for x in sequence]
     # reverse and return to a string
     return "".join(complement_sequence[::-1])
 
 
-def parse_alignment(sam_line):
+def parse_alignment(sam_line, chromosomes=None):
     """Parse the information in a SAM formatted alignment.
 
+    If a ChromosomeDictionary is given, the chromosome is added to it.
+
     Returns a tuple of:
         name as string,
         mapped as boolean,
@@ -121,11 +124,15 @@ def parse_alignment(sam_line):
         mismatch_count = get_mismatches(parts[11:])
         start = int(parts[3]) - 1  # to make it 0-based
         end = start + len(tag_sequence)  # 1-based
-        position_string = "{}\t{}\t{}".format(parts[2], start, end)
+        chromosome = parts[2]
+        if chromosomes is not None:
+            chromosome = chromosomes.intern(chromosome)
+        position_string = "{}\t{}\t{}".format(chromosome, start, end)
     return (name, mapped, mismatch_count, tag_sequence, position_string, strand)
 
 
-def create_alignment_db(sam_openfile, library_name, database_prefix):
+def create_alignment_db(sam_openfile, library_name, database_prefix, queue_depth=QUEUE_DEPTH,
+                        mismatch_bins=MISMATCH_BINS):
     """Create alignment SQLite3 databases representing alignment data from Bowtie SAM file.
 
     Database files:
@@ -134,68 +141,98 @@ def create_alignment_db(sam_openfile, library_name, database_prefix):
                              End (0-based),
                              Strand (+,-,or .),
                              Tag Sequence,
-                             Number of Mismatches
+                             Number of Mismatches (the NM edit distance, which
+                             also counts inserted and deleted bases, when the
+                             alignment has an NM flag; otherwise mismatched
+                             bases from the MD flag)
         {prefix}_{library}.db: (ip) Tag Sequence,
                                 Abundance
         {prefix}_tags.db: (ip) Tag Sequence,
                           Total Mappings,
                           Mappings with 0 mismatches (perfect),
                           Mappings with 1 mismatch,
-                          Mappings with 2 mismatches"""
-    #TODO create_chromosome_db(sam_openfile, database_prefix)
+                          ...
+                          Mappings with mismatch_bins - 1 or more mismatches
+                          (mismatches counted as in tagloci: NM if present, else MD)
+        {prefix}_chromosomes.db: (ip) Chromosome ID,
+                                 Chromosome,
+                                 Length (0 if unknown)
+                                 (from the @SQ header lines and any chromosomes
+                                 found in the alignments; shared with
+                                 create_cluster_files.py and split_by_position.py)
+
+    Input is prefetched and output written by background threads
+    (see commonIO.BackgroundWriter) unless queue_depth is 0."""
+    if mismatch_bins < 1:
+        raise ValueError("mismatch_bins must be at least 1, not {}".format(mismatch_bins))
+    chromosomes = ChromosomeDictionary.load(database_prefix)
     tagloci = "{}_tagloci".format(database_prefix)
     library = "{}_{}".format(database_prefix, library_name)
     tags = "{}_tags".format(database_prefix)
 
-    # scan through header lines
+    # scan through header lines, collecting chromosomes from @SQ lines
     header = sam_openfile.readline()
     while header[0] == "@":
+        chromosomes.add_sam_header(header)
         header = sam_openfile.readline()
 
-    mismatch_tally = [0, 0, 0]
-    # parse initial alignment
-    (read_name, maps, mismatches, tag, position, strand) = parse_alignment(header.strip())
-    if maps:
-        write_data("{}\t{}\t{}\t{}".format(position, tag, mismatches, strand), "{}.data".format(tagloci))
-        mismatch_tally[mismatches] += 1
-    last_read_name = read_name
-    last_tag = tag
-
-    for alignment in read_chunk(sam_openfile, CHUNK):
-        (read_name, maps, mismatches, tag, position, strand) = parse_alignment(alignment)
-        if maps:  # don't process unmapped reads
-            write_data("{}\t{}\t{}\t{}".format(position, tag, mismatches, strand), "{}.data".format(tagloci))
-            if read_name == last_read_name:
-                mismatch_tally[mismatches] += 1
-            else:
-                write_data("{}\t1".format(last_tag), "{}.data".format(library))
-                # prepare output for tags database
-                mismatch_string = "\t".join(str(m) for m in mismatch_tally)
-                write_data("{}\t{}\t{}".format(last_tag, sum(mismatch_tally), mismatch_string),
-                           "{}.data".format(tags))
-                # reset for next round
-                last_read_name = read_name
-                last_tag = tag
-                mismatch_tally = [0, 0, 0]
-                mismatch_tally[mismatches] += 1
-    # write out last tag
-    write_data("{}\t1".format(last_tag), "{}.data".format(library))
-    # prepare output for tags database
-    mismatch_string = "\t".join(str(m) for m in mismatch_tally)
-    write_data("{}\t{}\t{}".format(last_tag, sum(mismatch_tally), mismatch_string),
-               "{}.data".format(tags))
-
-
-if __name__ == "__main__":
-    (args, input_from_stdin) = get_commandline_args()
+    with open("{}.data".format(tagloci), "a") as tagloci_file, \
+            open("{}.data".format(library), "a") as library_file, \
+            open("{}.data".format(tags), "a") as tags_file, \
+            BackgroundWriter(tagloci_file, queue_depth) as tagloci_output, \
+            BackgroundWriter(library_file, queue_depth) as library_output, \
+            BackgroundWriter(tags_file, queue_depth) as tags_output:
+        last_bin = mismatch_bins - 1
+        mismatch_tally = [0] * mismatch_bins
+        # parse initial alignment
+        (read_name, maps, mismatches, tag, position, strand) = parse_alignment(header.strip(), chromosomes)
+        if maps:
+            tagloci_output.write("{}\t{}\t{}\t{}\n".format(position, tag, mismatches, strand))
+            mismatch_tally[min(mismatches, last_bin)] += 1
+        last_read_name = read_name
+        last_tag = tag
+
+        for alignment in read_lines(sam_openfile, CHUNK, queue_depth):
+            (read_name, maps, mismatches, tag, position, strand) = parse_alignment(alignment, chromosomes)
+            if maps:  # don't process unmapped reads
+                tagloci_output.write("{}\t{}\t{}\t{}\n".format(position, tag, mismatches, strand))
+                if read_name == last_read_name:
+                    mismatch_tally[min(mismatches, last_bin)] += 1
+                else:
+                    library_output.write("{}\t1\n".format(last_tag))
+                    # prepare output for tags database
+                    mismatch_string = "\t".join(str(m) for m in mismatch_tally)
+                    tags_output.write("{}\t{}\t{}\n".format(last_tag, sum(mismatch_tally), mismatch_string))
+                    # reset for next round
+                    last_read_name = read_name
+                    last_tag = tag
+                    mismatch_tally = [0] * mismatch_bins
+                    mismatch_tally[min(mismatches, last_bin)] += 1
+        # write out last tag
+        library_output.write("{}\t1\n".format(last_tag))
+        # prepare output for tags database
+        mismatch_string = "\t".join(str(m) for m in mismatch_tally)
+        tags_output.write("{}\t{}\t{}\n".format(last_tag, sum(mismatch_tally), mismatch_string))
+    chromosomes.save(database_prefix)
+
+
+def main(argv=None):
+    """Run create_alignment_db.py with command-line arguments argv (default: sys.argv[1:])."""
+    (args, input_from_stdin) = get_commandline_args(argv)
     try:
         if input_from_stdin:
             in_file = sys.stdin
-            create_alignment_db(in_file, args.library_name, args.database_prefix)
+            create_alignment_db(in_file, args.library_name, args.database_prefix, args.queue_depth,
+                                args.mismatch_bins)
         else:
             with open(args.input) as in_file:
-                create_alignment_db(in_file, args.library_name, args.database_prefix)
+                create_alignment_db(in_file, args.library_name, args.database_prefix, args.queue_depth,
+                                    args.mismatch_bins)
     except IOError as error:
         sys.stderr.write("Could not open file: {}\n".format(error.filename))
         sys.stderr.flush()
         raise IOError(error)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,16 +20,23 @@ Copyright (C) 2014 Joy-El R.B. Talbot
 
 __author__ = 'Joy-El R.B. Talbot'
 
-from commonIO import read_chunk
 from commonIO import CustomParser
+from commonIO import BackgroundWriter
+from chromosomes import ChromosomeDictionary
+from chromosomes import intern_strand
 import datetime
+import heapq
+import itertools
 import sys
+import tempfile
 import re
 
-CHUNK = 4096  # bytes of input read per IO call with read_chunk
+CHUNK = 4096  # bytes of input read per IO call with LociReader
+TAG_MEMORY = 1000000  # distinct tags per cluster held in memory before spilling to disk
+MERGE_RUNS = 64  # spilled run files merged into one once this many are open
 
 
-def get_commandline_args():
+def get_commandline_args(argv=None):
     """Command-line interface for create_alignment_db.py"""
     parser = CustomParser(
         description='''create_cluster_files.py creates flat data files for clusters and
@@ -50,7 +57,16 @@ Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License versi
                         metavar="NAME",
                         type=str,
                         default=datetime.datetime.now().strftime('%y%m%d-%H%M%S'))
-    arguments = parser.parse_args()
+    parser.add_argument("--tag_memory",
+                        help="distinct tags per cluster kept in memory before spilling to temporary files; "
+                             "default = {}".format(TAG_MEMORY),
+                        metavar="TAGS",
+                        type=int,
+                        default=TAG_MEMORY)
+    arguments = parser.parse_args(argv)
+
+    if arguments.tag_memory < 1:
+        parser.error("--tag_memory must be at least 1")
 
     if arguments.input is None:
         use_stdin = True
@@ -67,7 +83,211 @@ def get_unique_tags(all_tags):
     return list(set(all_tags))
 
 
-def create_cluster_files(loci_openfile, library_name, database_prefix):
+class UniqueTags(object):
+    """Deduplicate a stream of tags in bounded memory.
+
+    Tags are hashed into a set until memory_limit distinct tags are held; the
+    set is then written sorted to a temporary run file and cleared, and every
+    MERGE_RUNS run files are merged into one. unique() returns the set directly
+    if nothing was spilled, otherwise it merges the sorted runs and drops
+    repeats (an external sort-unique)."""
+    def __init__(self, memory_limit=TAG_MEMORY):
+        if memory_limit < 1:
+            raise ValueError("UniqueTags memory_limit must be at least 1, not {}".format(memory_limit))
+        self.memory_limit = memory_limit
+        self.tags = set()
+        self.runs = []
+
+    def add(self, tag):
+        """Add a tag, spilling to disk once memory_limit distinct tags are held."""
+        self.tags.add(tag)
+        if len(self.tags) >= self.memory_limit:
+            self.spill()
+
+    def update(self, tags):
+        """Add every tag from an iterable, filling the set a slice at a time."""
+        tags = iter(tags)
+        while True:
+            # never take more tags than the set has room for, so it holds at most memory_limit
+            tag_slice = list(itertools.islice(tags, self.memory_limit - len(self.tags)))
+            if not tag_slice:
+                break
+            self.tags.update(tag_slice)
+            if len(self.tags) >= self.memory_limit:
+                self.spill()
+
+    def spill(self):
+        """Write the in-memory tags to a sorted temporary run file."""
+        run = tempfile.TemporaryFile(mode="w+")
+        for tag in sorted(self.tags):
+            run.write(tag + "\n")
+        run.seek(0)
+        self.runs.append(run)
+        self.tags = set()
+        if len(self.runs) >= MERGE_RUNS:
+            merged = tempfile.TemporaryFile(mode="w+")
+            for tag in self._merge_runs([]):
+                merged.write(tag + "\n")
+            merged.seek(0)
+            for run in self.runs:
+                run.close()
+            self.runs = [merged]
+
+    def _merge_runs(self, tags):
+        """Yield each distinct tag of the run files and the sorted list tags once, in order."""
+        sorted_streams = [(line[:-1] for line in run) for run in self.runs]
+        sorted_streams.append(iter(tags))
+        last_tag = None
+        for tag in heapq.merge(*sorted_streams):
+            if tag != last_tag:
+                yield tag
+                last_tag = tag
+
+    def unique(self):
+        """Yield each distinct tag once; may only be iterated once after a spill."""
+        if not self.runs:
+            for tag in self.tags:
+                yield tag
+        else:
+            for tag in self._merge_runs(sorted(self.tags)):
+                yield tag
+
+    def close(self):
+        """Remove any temporary run files."""
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.tags = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class LociReader(object):
+    """Read a merged loci file one line at a time as (columns, tags) in bounded memory.
+
+    columns holds every column except the tag field (the 4th). A line shorter
+    than line_limit characters is read whole and tags is a list, which cannot
+    hold line_limit or more tags. For a longer line tags is an iterator that
+    reads the tag field from the file a block at a time, and the columns after
+    the tag field are added to columns once it is exhausted; at most about
+    line_limit + chunk_size characters of a line are held in memory."""
+    tag_end = re.compile("[;\t\n]")
+
+    def __init__(self, loci_openfile, chunk_size=CHUNK, line_limit=TAG_MEMORY):
+        if line_limit < 1:
+            raise ValueError("LociReader line_limit must be at least 1, not {}".format(line_limit))
+        self.loci_openfile = loci_openfile
+        self.chunk_size = chunk_size
+        self.line_limit = line_limit
+        self.buffer = ""
+        self.position = 0  # start of the unread part of buffer
+
+    def _find_line_end(self, limit=None):
+        """Read until the unread buffer holds a newline, limit characters (if given) or
+        the rest of the file; returns the index of the newline in buffer, or -1."""
+        newline = self.buffer.find("\n", self.position)
+        if newline != -1:
+            return newline
+        pieces = [self.buffer[self.position:]]
+        size = len(pieces[0])
+        while limit is None or size < limit:
+            block = self.loci_openfile.read(self.chunk_size)
+            if not block:
+                break
+            newline = block.find("\n")
+            pieces.append(block)
+            if newline != -1:
+                newline += size
+                break
+            size += len(block)
+        self.buffer = "".join(pieces)
+        self.position = 0
+        return newline
+
+    def _find_tag_field(self):
+        """Return the index in buffer where the current line's tag field starts,
+        reading more of the file if the first three columns are not all buffered."""
+        while True:
+            tab = self.position - 1
+            for _ in range(3):
+                tab = self.buffer.find("\t", tab + 1)
+                if tab == -1:
+                    break
+            else:
+                return tab + 1
+            block = self.loci_openfile.read(self.chunk_size)
+            if not block:
+                raise ValueError("Merged loci line has no tag field: {}".format(self.buffer[self.position:]))
+            self.buffer = self.buffer[self.position:] + block
+            self.position = 0
+
+    def _stream_tags(self, columns):
+        """Yield the tags of the current line, reading more of the file as needed,
+        then add the columns after the tag field to columns."""
+        tag_pieces = []  # the start of a tag split across blocks
+        while True:
+            match = self.tag_end.search(self.buffer, self.position)
+            if match is None:
+                tag_pieces.append(self.buffer[self.position:])
+                self.buffer = self.loci_openfile.read(self.chunk_size)
+                self.position = 0
+                if self.buffer:
+                    continue
+                separator = "\n"  # end of file
+                tag_end = 0
+            else:
+                separator = match.group()
+                tag_end = match.start()
+            if tag_pieces:
+                tag_pieces.append(self.buffer[self.position:tag_end])
+                tag = "".join(tag_pieces)
+                tag_pieces = []
+            else:
+                tag = self.buffer[self.position:tag_end]
+            self.position = tag_end + 1
+            yield tag
+            if separator == "\n":
+                break
+            elif separator == "\t":
+                newline = self._find_line_end()
+                if newline == -1:
+                    newline = len(self.buffer)
+                columns.extend(self.buffer[self.position:newline].split("\t"))
+                self.position = newline + 1
+                break
+
+    def __iter__(self):
+        while True:
+            newline = self._find_line_end(self.line_limit)
+            if newline == -1:
+                if self.position >= len(self.buffer):
+                    break  # end of file
+                line_end = len(self.buffer)  # last line, without a trailing newline
+            else:
+                line_end = newline
+            if line_end == self.position:
+                self.position += 1  # skip blank lines
+            elif line_end - self.position < self.line_limit:
+                parts = self.buffer[self.position:line_end].split("\t")
+                self.position = line_end + 1
+                yield parts[:3] + parts[4:], parts[3].split(";")
+            else:
+                # a huge cluster: stream its tag field
+                tags_start = self._find_tag_field()
+                columns = self.buffer[self.position:tags_start - 1].split("\t")
+                self.position = tags_start
+                tags = self._stream_tags(columns)
+                yield columns, tags
+                for _ in tags:
+                    pass  # skip any tags the caller did not read
+
+
+def create_cluster_files(loci_openfile, library_name, database_prefix, tag_memory=TAG_MEMORY):
     """Create cluster and cluster-tag files from merged loci.
 
     Database files:
@@ -79,44 +299,68 @@ def create_cluster_files(loci_openfile, library_name, database_prefix):
                              Strand (+,-,or .)
         {prefix}_clustertags.db: cluster_name,
                                 tag_sequence
-                                (together the two will be unique)"""
+                                (together the two will be unique)
+        {prefix}_chromosomes.db: chromosome dictionary shared with
+                                 create_alignment_db.py (see chromosomes.py),
+                                 extended with any new cluster chromosomes
+
+    Lines shorter than tag_memory characters are deduplicated with a set. The
+    tag field of a longer line is read from the file in blocks (see LociReader)
+    and deduplicated with UniqueTags, so at most tag_memory distinct tags per
+    cluster are held in memory."""
     clusters = "{}_clusters".format(database_prefix)
     clustertags = "{}_clustertags".format(database_prefix)
 
+    chromosomes = ChromosomeDictionary.load(database_prefix)
     cluster_index = 1
 
-    for cluster in read_chunk(loci_openfile, CHUNK):
-        parts = cluster.split("\t")
-        tags = parts[3].split(";")
-        unique_tags = get_unique_tags(tags)
-        if len(parts) == 6:
-            strand = parts[-1]
-        else:
-            strand = "."
-        with open("{}.data".format(clusters), 'a') as output:
-            output.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(parts[0],
-                                                           parts[1],
-                                                           parts[2],
-                                                           "{}_{}".format(library_name, cluster_index),
-                                                           len(unique_tags),
-                                                           strand))
-        with open("{}.data".format(clustertags), 'a') as output:
-            for tag in unique_tags:
-                output.write("{}\t{}\n".format("{}_{}".format(library_name, cluster_index),
-                                               tag))
-        cluster_index += 1
+    with open("{}.data".format(clusters), 'a') as clusters_file, \
+            open("{}.data".format(clustertags), 'a') as clustertags_file, \
+            BackgroundWriter(clusters_file) as clusters_output, \
+            BackgroundWriter(clustertags_file) as clustertags_output:
+        for (columns, tags) in LociReader(loci_openfile, CHUNK, tag_memory):
+            cluster_name = "{}_{}".format(library_name, cluster_index)
+            tag_count = 0
+            if isinstance(tags, list):
+                # a short line holds fewer than tag_memory tags, so a set stays within the limit
+                for tag in get_unique_tags(tags):
+                    clustertags_output.write("{}\t{}\n".format(cluster_name, tag))
+                    tag_count += 1
+            else:
+                with UniqueTags(tag_memory) as unique_tags:
+                    unique_tags.update(tags)
+                    for tag in unique_tags.unique():
+                        clustertags_output.write("{}\t{}\n".format(cluster_name, tag))
+                        tag_count += 1
+            if len(columns) == 5:
+                strand = intern_strand(columns[-1])
+            else:
+                strand = "."
+            clusters_output.write("{}\t{}\t{}\t{}\t{}\t{}\n".format(chromosomes.intern(columns[0]),
+                                                                 columns[1],
+                                                                 columns[2],
+                                                                 cluster_name,
+                                                                 tag_count,
+                                                                 strand))
+            cluster_index += 1
+    chromosomes.save(database_prefix)
 
 
-if __name__ == "__main__":
-    (args, input_from_stdin) = get_commandline_args()
+def main(argv=None):
+    """Run create_cluster_files.py with command-line arguments argv (default: sys.argv[1:])."""
+    (args, input_from_stdin) = get_commandline_args(argv)
     try:
         if input_from_stdin:
             in_file = sys.stdin
-            create_cluster_files(in_file, args.library_name, args.database_prefix)
+            create_cluster_files(in_file, args.library_name, args.database_prefix, args.tag_memory)
         else:
             with open(args.input) as in_file:
-                create_cluster_files(in_file, args.library_name, args.database_prefix)
+                create_cluster_files(in_file, args.library_name, args.database_prefix, args.tag_memory)
     except IOError as error:
         sys.stderr.write("Could not open file: {}\n".format(error.filename))
         sys.stderr.flush()
         raise IOError(error)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,14 @@ import argparse
 import re
 import sys
 from commonIO import CustomParser
-from commonIO import read_chunk
+from commonIO import BackgroundWriter
+from commonIO import read_lines
+from commonIO import QUEUE_DEPTH
+from chromosomes import ChromosomeDictionary
+from chromosomes import intern_strand
 
 CHUNK_SIZE = 4096  # bytes of input read per IO call with read_chunk
+BED_BATCH = 1024  # reads formatted per batch by BEDBatchWriter
 
 
 class ReadError(Exception):
@@ -34,17 +39,39 @@ class ReadError(Exception):
         return 'ReadError - {}: {}'.format(self.name, self.message)
 
 
+class ReadFormat(object):
+    """Input format and chromosome strings for one stream of reads.
+
+    Pass one ReadFormat per stream to Read so that several streams (e.g. in
+    separate threads) can be parsed at once without sharing Read.input_format."""
+
+    __slots__ = ['input_format', 'chromosomes']
+
+    def __init__(self, input_format=None):
+        self.input_format = input_format
+        self.chromosomes = ChromosomeDictionary()
+
+    def update_input_format(self, read_string):
+        """Determine the format of a read (see Read.detect_input_format)."""
+        self.input_format = Read.detect_input_format(read_string)
+
+
 class Read(object):
     """Describes a read based on its chromosomal coordinates"""
 
     __slots__ = ['chromosome', 'strand', 'name', 'positions']
 
     input_format = None
+    chromosomes = None  # no class-wide chromosome strings; see ReadFormat
 
-    def __init__(self, read_string):
+    def __init__(self, read_string, read_format=None):
         """Create read object from an alignment.
 
-        self.positions is an array of chromosomal positions from the 5' to 3' ends of the read in a 0-based format"""
+        self.positions is an array of chromosomal positions from the 5' to 3' ends of the read in a 0-based format
+        self.strand and, given a read_format, self.chromosome are shared (interned) strings
+        read_format is the ReadFormat of the read's stream; without one the format is shared class-wide"""
+        if read_format is None:
+            read_format = Read
         assigned = False
         attempt = 0
         while not assigned and attempt < 3:
@@ -52,16 +79,19 @@ class Read(object):
                 (self.chromosome,
                  self.strand,
                  self.name,
-                 self.positions) = Read.parse_read_string(read_string, Read.input_format)
+                 self.positions) = Read.parse_read_string(read_string, read_format.input_format)
+                if read_format.chromosomes is not None:
+                    self.chromosome = read_format.chromosomes.intern(self.chromosome)
+                self.strand = intern_strand(self.strand)
                 assigned = True
             except ReadError as _error:
                 if _error.name == 'unmapped':
                     raise ReadError(_error.message, _error.name)
                 else:
-                    Read.update_input_format(read_string)
+                    read_format.update_input_format(read_string)
                     attempt += 1
             except AttributeError:
-                Read.update_input_format(read_string)
+                read_format.update_input_format(read_string)
                 attempt += 1
 
     def __str__(self):
@@ -91,14 +121,14 @@ class Read(object):
     @classmethod
     def parse_BED_read_string(cls, read_string):
         """Parses a BED formatted read."""
-        BED_data = re.search("^(\S+)\t([0-9]+)\t([0-9]+)\t(\S+)\t\S+\t([+-.])", read_string).groups()
+        BED_data = re.search(r"^(\S+)\t([0-9]+)\t([0-9]+)\t(\S+)\t\S+\t([+-.])", read_string).groups()
         (chromosome, start, end, name, strand) = BED_data
         start = int(start)  # already 0-based
         end = int(end) - 1  # convert from 1-based to 0-based
         if strand == "-":
-            positions = range(end, start - 1, -1)  # start - 1 to get all inclusive
+            positions = list(range(end, start - 1, -1))  # start - 1 to get all inclusive
         else:  # assume '+' strand if strand is not given ('.')
-            positions = range(start, end + 1)  # end + 1 to get all inclusive start to end
+            positions = list(range(start, end + 1))  # end + 1 to get all inclusive start to end
         return chromosome, strand, name, positions
 
     @classmethod
@@ -107,7 +137,7 @@ class Read(object):
         # important bitwise tags:
         unmapped = 0x4
         antisense = 0x10
-        SAM_data = re.search("^(\S+)\t([0-9]+)\t(\S+)\t([0-9]+)\t[0-9]+\t(\S+)\t\S+\t[0-9]+\t[0-9]+\t(\S+)\t", read_string).groups()
+        SAM_data = re.search(r"^(\S+)\t([0-9]+)\t(\S+)\t([0-9]+)\t[0-9]+\t(\S+)\t\S+\t[0-9]+\t[0-9]+\t(\S+)\t", read_string).groups()
         (name, bitstring, chromosome, start, cigar, sequence) = SAM_data
         bitstring = int(bitstring)
         if (bitstring & unmapped) == unmapped:
@@ -138,12 +168,12 @@ class Read(object):
 
         # sometimes the CIGAR value is a sole "*", in which case assume a perfect match
         if cigar == "*":
-            positions = range(read_start, read_start + sequence_length)  # will give start to end inclusive
+            positions = list(range(read_start, read_start + sequence_length))  # will give start to end inclusive
         else:
             positions = []
             current_position = read_start
             # separate CIGAR string into nucleotide counts and CIGAR codes
-            cigar_entries = re.findall('(\d+)([{}])'.format(''.join(cigar_codes.keys())), cigar)
+            cigar_entries = re.findall(r'(\d+)([{}])'.format(''.join(cigar_codes.keys())), cigar)
             for (nucleotide_length, code) in cigar_entries:
                 nucleotide_length = int(nucleotide_length)
                 if cigar_codes[code]['count']:
@@ -161,24 +191,91 @@ class Read(object):
 
     @classmethod
     def update_input_format(cls, read_string):
-        """Determine the format of a read via a match to a regular expression.  Currently BED vs. SAM"""
+        """Determine the format of a read for all reads without their own ReadFormat."""
+        cls.input_format = cls.detect_input_format(read_string)
+
+    @classmethod
+    def detect_input_format(cls, read_string):
+        """Return the format of a read via a match to a regular expression.  Currently BED vs. SAM"""
+        input_format = None
         string = r'\S+'
         integer = r'[0-9]+'
         strand = r'[+-.]'
         possible_formats = {'BED': '\t'.join([string, integer, integer, string, string, strand]),
                             'SAM': '\t'.join([string, integer, string, integer, integer, string, string, integer, integer, string, string])}
-        unknown_format = True
-        for possible_format in possible_formats:
+        for possible_format in sorted(possible_formats):
             if re.match(possible_formats[possible_format], read_string) is not None:
-                unknown_format = False
-                cls.input_format = possible_format
-        if unknown_format:
+                input_format = possible_format
+        if input_format is None:
             raise ReadError('''Could not determine the read format of string: {}
             Currently stored formats are:
                 {}'''.format(read_string, possible_formats))
+        return input_format
+
+
+class BEDBatchWriter(object):
+    """Format Read objects as BED lines a batch at a time.
+
+    Output is byte-identical to Read.print_first_base (or Read.__str__ when
+    first_base_only is False), one line per read; each batch is sent to output
+    with a single write call."""
+    def __init__(self, output, first_base_only=True, batch_size=BED_BATCH):
+        self.output = output
+        self.first_base_only = first_base_only
+        self.batch_size = batch_size
+        self.reads = []
+        self._chromosome_fields = {}  # chromosome -> 'chromosome\t'
+        self._strand_fields = {}  # strand -> '\t0\tstrand\n'
+
+    def format_batch(self, reads):
+        """Return the BED lines for reads as one string."""
+        chromosome_fields = self._chromosome_fields
+        strand_fields = self._strand_fields
+        lines = []
+        add_line = lines.append
+        for read in reads:
+            chromosome = chromosome_fields.get(read.chromosome)
+            if chromosome is None:
+                chromosome = chromosome_fields[read.chromosome] = read.chromosome + '\t'
+            strand = strand_fields.get(read.strand)
+            if strand is None:
+                strand = strand_fields[read.strand] = '\t0\t' + read.strand + '\n'
+            start = read.positions[0]
+            if self.first_base_only:
+                end = start + 1
+            else:
+                end = read.positions[-1] + 1
+            add_line(chromosome + str(start) + '\t' + str(end) + '\t' + read.name + strand)
+        return ''.join(lines)
+
+    def write(self, read):
+        """Queue a read for output, writing the batch once batch_size reads are held."""
+        self.reads.append(read)
+        if len(self.reads) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write out any queued reads."""
+        if self.reads:
+            self.output.write(self.format_batch(self.reads))
+            self.reads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            # write the reads formatted before the error, without masking the error
+            try:
+                self.flush()
+            except Exception:
+                pass
+        return False
 
 
-def get_arguments():
+def get_arguments(argv=None):
     """Command-line interface for extract_5prime-most-base.py"""
     parser = CustomParser(
         description='''extract_5prime_most_base.py extracts the chromosomal coordinates of
@@ -196,6 +293,12 @@ the GNU General Public License version 3
     parser.add_argument('-o', '--output',
                         help="Name for output BED file of 5'-most bases, omit to write to commandline",
                         metavar="5'-MOST BASES")
+    parser.add_argument('--queue_depth',
+                        help='blocks buffered between the I/O threads and parsing, 0 disables threaded I/O; '
+                             'default = {}'.format(QUEUE_DEPTH),
+                        metavar='BLOCKS',
+                        type=int,
+                        default=QUEUE_DEPTH)
     parser.add_argument('--use_stdin',
                         help=argparse.SUPPRESS,
                         default=True)
@@ -203,7 +306,7 @@ the GNU General Public License version 3
                         help=argparse.SUPPRESS,
                         default=True)
 
-    arguments = parser.parse_args()
+    arguments = parser.parse_args(argv)
 
     if arguments.input is not None:
         arguments.use_stdin = False
@@ -235,34 +338,48 @@ Please choose a different filename or delete the existing file.\n'''.format(file
         sys.exit(1)
 
 
-def extract_5prime_most_base(alignments_source, output_to_stdout, output_filename):
-    """Extract the 5'-most base from each alignment."""
-    for alignment in read_chunk(alignments_source, CHUNK_SIZE):
-        if alignment[0] != "@" and alignment[0] != "#":  # skip any header/comment lines
-            try:
-                read = Read(alignment)
-                if output_to_stdout:
-                    print read.print_first_base()
-                else:
-                    with open(output_filename, 'a') as output:
-                        output.write('{}\n'.format(read.print_first_base()))
-            except ReadError as _error:
-                if _error.name != 'unmapped':  # silently skip unmapped reads only
-                    raise ReadError(_error.message, _error.name)
-
+def extract_5prime_most_base(alignments_source, output_to_stdout, output_filename, queue_depth=QUEUE_DEPTH):
+    """Extract the 5'-most base from each alignment.
 
-if __name__ == '__main__':
-    args = get_arguments()
+    Reads are formatted in batches by BEDBatchWriter; reading and writing run in
+    background threads (see commonIO.BackgroundWriter) unless queue_depth is 0."""
+    read_format = ReadFormat()
+    if output_to_stdout:
+        output = sys.stdout
+    else:
+        output = open(output_filename, 'a')
+    try:
+        with BackgroundWriter(output, queue_depth) as writer, BEDBatchWriter(writer) as bed_writer:
+            for alignment in read_lines(alignments_source, CHUNK_SIZE, queue_depth):
+                if alignment[0] != "@" and alignment[0] != "#":  # skip any header/comment lines
+                    try:
+                        read = Read(alignment, read_format)
+                        bed_writer.write(read)
+                    except ReadError as _error:
+                        if _error.name != 'unmapped':  # silently skip unmapped reads only
+                            raise ReadError(_error.message, _error.name)
+    finally:
+        if not output_to_stdout:
+            output.close()
+
+
+def main(argv=None):
+    """Run extract_5prime_most_base.py with command-line arguments argv (default: sys.argv[1:])."""
+    args = get_arguments(argv)
     if not args.use_stdout:
         confirm_new_file(args.output)
     if args.use_stdin:
         input_ = sys.stdin
-        extract_5prime_most_base(input_, args.use_stdout, args.output)
+        extract_5prime_most_base(input_, args.use_stdout, args.output, args.queue_depth)
     else:
         try:
             with open(args.input) as input_:
-                extract_5prime_most_base(input_, args.use_stdout, args.output)
+                extract_5prime_most_base(input_, args.use_stdout, args.output, args.queue_depth)
         except IOError as error:
             sys.stderr.write('Could not open alignment file: {}\n'.format(error.filename))
             sys.stderr.flush()
-            raise IOError(error)
\ No newline at end of file
+            raise IOError(error)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+"""generate_test_data.py writes seeded synthetic Bowtie SAM, BED, merged loci
+and FASTQ files for testing and benchmarking SequenceTools.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import random
+import sys
+from commonIO import CustomParser
+
+BASES = 'ACGT'
+CHROMOSOMES = 5  # number of chromosomes in the synthetic genome
+CHROMOSOME_LENGTH = 50000000  # bases per synthetic chromosome
+MIN_LENGTH = 16  # shortest synthetic read
+MAX_LENGTH = 35  # longest synthetic read
+
+
+class SyntheticData(object):
+    """Seeded generator of small-RNA-like reads and their alignments.
+
+    Tags (read sequences) are drawn from a pool smaller than the number of
+    reads so that tags repeat, as they do in small RNA libraries."""
+    def __init__(self, seed=1, chromosomes=CHROMOSOMES, chromosome_length=CHROMOSOME_LENGTH,
+                 max_mismatches=2, multimapper_rate=0.2, max_mappings=5, unmapped_rate=0.05,
+                 gapped_rate=0.05, antisense_rate=0.5):
+        self.random = random.Random(seed)
+        self.chromosomes = ['chr{}'.format(c) for c in range(1, chromosomes + 1)]
+        self.chromosome_length = chromosome_length
+        self.max_mismatches = max_mismatches
+        self.multimapper_rate = multimapper_rate
+        self.max_mappings = max_mappings
+        self.unmapped_rate = unmapped_rate
+        self.gapped_rate = gapped_rate
+        self.antisense_rate = antisense_rate
+
+    def sequence(self, length=None):
+        """Return a random DNA sequence."""
+        if length is None:
+            length = self.random.randint(MIN_LENGTH, MAX_LENGTH)
+        return ''.join(self.random.choice(BASES) for _ in range(length))
+
+    def tag_pool(self, reads):
+        """Return a list of distinct-ish tags sized for a library of reads."""
+        return [self.sequence() for _ in range(max(1, reads // 4))]
+
+    def cigar_and_md(self, length):
+        """Return (cigar, md, edit distance) for an alignment of a read of length bases.
+
+        Mostly ungapped matches; a gapped_rate fraction include soft clipping,
+        an insertion, a deletion or a skipped (N) region."""
+        mismatches = self.random.randint(0, self.max_mismatches)
+        if self.random.random() >= self.gapped_rate or length < 12:
+            operations = [(length, 'M')]
+        else:
+            clip = self.random.randint(1, 3)
+            first = self.random.randint(4, length - clip - 5)
+            rest = length - clip - first
+            gap = self.random.choice(['I', 'D', 'N'])
+            if gap == 'I':
+                operations = [(first, 'M'), (1, 'I'), (rest - 1, 'M'), (clip, 'S')]
+            elif gap == 'D':
+                operations = [(first, 'M'), (self.random.randint(1, 3), 'D'), (rest, 'M'), (clip, 'S')]
+            else:
+                operations = [(first, 'M'), (self.random.randint(50, 5000), 'N'), (rest, 'M'), (clip, 'S')]
+        cigar = ''.join('{}{}'.format(size, code) for (size, code) in operations)
+
+        # MD covers the aligned (M) and deleted (D) reference bases
+        md_parts = []
+        matched = 0
+        edit_distance = 0
+        aligned = sum(size for (size, code) in operations if code == 'M')
+        mismatch_offsets = set(self.random.sample(range(aligned), min(mismatches, aligned)))
+        offset = 0
+        for (size, code) in operations:
+            if code == 'M':
+                for _ in range(size):
+                    if offset in mismatch_offsets:
+                        md_parts.append('{}{}'.format(matched, self.random.choice(BASES)))
+                        matched = 0
+                        edit_distance += 1
+                    else:
+                        matched += 1
+                    offset += 1
+            elif code == 'D':
+                md_parts.append('{}^{}'.format(matched, self.sequence(size)))
+                matched = 0
+                edit_distance += size
+            elif code == 'I':
+                edit_distance += size
+        md_parts.append(str(matched))
+        return cigar, ''.join(md_parts), edit_distance
+
+    def sam_header(self):
+        """Return SAM header lines as written by Bowtie."""
+        lines = ['@HD\tVN:1.0\tSO:unsorted']
+        for chromosome in self.chromosomes:
+            lines.append('@SQ\tSN:{}\tLN:{}'.format(chromosome, self.chromosome_length))
+        lines.append('@PG\tID:Bowtie\tVN:1.0.0\tCL:"generate_test_data.py"')
+        return lines
+
+    def sam_alignments(self, reads):
+        """Yield SAM alignment lines for reads, grouped by read as Bowtie writes them."""
+        tags = self.tag_pool(reads)
+        for index in range(reads):
+            name = 'read{}'.format(index)
+            tag = self.random.choice(tags)
+            quality = 'I' * len(tag)
+            if self.random.random() < self.unmapped_rate:
+                yield '\t'.join([name, '4', '*', '0', '0', '*', '*', '0', '0', tag, quality, 'XM:i:0'])
+                continue
+            if self.random.random() < self.multimapper_rate:
+                mappings = self.random.randint(2, self.max_mappings)
+            else:
+                mappings = 1
+            for mapping in range(mappings):
+                flag = 0
+                sequence = tag
+                if self.random.random() < self.antisense_rate:
+                    flag = 16
+                    sequence = reverse_complement(tag)
+                if mapping > 0:
+                    flag |= 256  # secondary alignment
+                (cigar, md, edit_distance) = self.cigar_and_md(len(tag))
+                yield '\t'.join([name, str(flag), self.random.choice(self.chromosomes),
+                                 str(self.random.randint(1, self.chromosome_length - 10000)), '255', cigar,
+                                 '*', '0', '0', sequence, quality,
+                                 'XA:i:{}'.format(edit_distance), 'MD:Z:{}'.format(md),
+                                 'NM:i:{}'.format(edit_distance)])
+
+    def bed_intervals(self, reads):
+        """Yield BED6 lines of read alignments."""
+        for index in range(reads):
+            start = self.random.randint(0, self.chromosome_length - 100)
+            yield '\t'.join([self.random.choice(self.chromosomes), str(start),
+                             str(start + self.random.randint(MIN_LENGTH, MAX_LENGTH)),
+                             'read{}'.format(index), '0', self.random.choice('+-')])
+
+    def merged_loci(self, clusters, tags_per_cluster=50):
+        """Yield merged loci lines (chromosome, start, end, ;-joined tags, count, strand)
+        as produced by merging tagloci with bedtools."""
+        tags = self.tag_pool(clusters * tags_per_cluster)
+        for _ in range(clusters):
+            start = self.random.randint(0, self.chromosome_length - 1000)
+            count = self.random.randint(1, 2 * tags_per_cluster)
+            cluster_tags = [self.random.choice(tags) for _ in range(count)]
+            yield '\t'.join([self.random.choice(self.chromosomes), str(start),
+                             str(start + self.random.randint(MIN_LENGTH, 500)),
+                             ';'.join(cluster_tags), str(count), self.random.choice('+-.')])
+
+    def fastq_reads(self, reads):
+        """Yield 4-line FASTQ records with lengths spread around the kept size range."""
+        for index in range(reads):
+            sequence = self.sequence(self.random.randint(MIN_LENGTH - 6, MAX_LENGTH + 10))
+            yield '@read{}\n{}\n+\n{}'.format(index, sequence, 'I' * len(sequence))
+
+
+def reverse_complement(sequence):
+    """Return the reverse complement of a DNA sequence."""
+    complement = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G', 'N': 'N'}
+    return ''.join(complement[base] for base in reversed(sequence))
+
+
+def write_lines(lines, filename):
+    """Write an iterable of lines to filename."""
+    with open(filename, 'w') as output:
+        for line in lines:
+            output.write(line + '\n')
+    return filename
+
+
+def write_test_data(prefix, reads, clusters, seed=1):
+    """Write {prefix}.sam, {prefix}.bed, {prefix}_loci.data and {prefix}.fastq.
+
+    Returns a dictionary of format name to filename."""
+    files = {}
+    data = SyntheticData(seed)
+    files['SAM'] = write_lines(data.sam_header() + list(data.sam_alignments(reads)), '{}.sam'.format(prefix))
+    files['BED'] = write_lines(data.bed_intervals(reads), '{}.bed'.format(prefix))
+    files['LOCI'] = write_lines(data.merged_loci(clusters), '{}_loci.data'.format(prefix))
+    files['FASTQ'] = write_lines(data.fastq_reads(reads), '{}.fastq'.format(prefix))
+    return files
+
+
+def get_arguments():
+    """Command-line interface for generate_test_data.py"""
+    parser = CustomParser(
+        description='''generate_test_data.py writes seeded synthetic Bowtie SAM, BED, merged loci
+and FASTQ files for testing and benchmarking SequenceTools.
+
+Copyright (C) 2015 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument('-p', '--prefix',
+                        help='prefix for output files, default = synthetic',
+                        metavar='PREFIX',
+                        default='synthetic')
+    parser.add_argument('-n', '--reads',
+                        help='number of reads in the SAM, BED and FASTQ files, default = 100000',
+                        metavar='N',
+                        type=int,
+                        default=100000)
+    parser.add_argument('-c', '--clusters',
+                        help='number of merged loci, default = 10000',
+                        metavar='N',
+                        type=int,
+                        default=10000)
+    parser.add_argument('-s', '--seed',
+                        help='random seed, default = 1',
+                        metavar='SEED',
+                        type=int,
+                        default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    for (file_format, filename) in sorted(write_test_data(args.prefix, args.reads, args.clusters, args.seed).items()):
+        sys.stderr.write('Wrote {} data to {}\n'.format(file_format, filename))
+    sys.stderr.flush()
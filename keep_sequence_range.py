@@ -21,12 +21,14 @@ __author__ = 'Joy-El R.B. Talbot'
 
 from commonIO import read_fastq_chunk
 from commonIO import CustomParser
+from commonIO import BackgroundWriter
+from commonIO import QUEUE_DEPTH
 import sys
 
 CHUNK = 4096  # bytes of input read per IO call with read_chunk
 
 
-def get_commandline_args():
+def get_commandline_args(argv=None):
     """Command-line interface for create_alignment_db.py"""
     parser = CustomParser(
         description='''keep_sequence_range.py return only those fastq reads within a specified
@@ -50,7 +52,13 @@ Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License versi
                         metavar="NT",
                         type=int,
                         default=35)
-    arguments = parser.parse_args()
+    parser.add_argument("--queue_depth",
+                        help="blocks buffered between the I/O threads and parsing, 0 disables threaded I/O; "
+                             "default = {}".format(QUEUE_DEPTH),
+                        metavar="BLOCKS",
+                        type=int,
+                        default=QUEUE_DEPTH)
+    arguments = parser.parse_args(argv)
 
     if arguments.input is None:
         use_stdin = True
@@ -69,12 +77,14 @@ Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License versi
     return (arguments, use_stdin, use_stdout)
 
 
-def keep_sequence_range(open_fastq_file, minimum_size, maximum_size, chunk_size):
-    """Return chunks of fastq data to keep."""
+def keep_sequence_range(open_fastq_file, minimum_size, maximum_size, chunk_size, queue_depth=0):
+    """Return chunks of fastq data to keep.
+
+    Input is prefetched by a reader thread when queue_depth is above 0."""
     output_chunks = ""
-    max_reads = chunk_size / 10
+    max_reads = chunk_size // 10
     kept_reads = 0
-    for read in read_fastq_chunk(open_fastq_file, chunk_size):
+    for read in read_fastq_chunk(open_fastq_file, chunk_size, queue_depth):
         if minimum_size <= len(read[1]) <= maximum_size:
             output_chunks += "\n".join(read) + "\n"
             kept_reads += 1
@@ -85,26 +95,39 @@ def keep_sequence_range(open_fastq_file, minimum_size, maximum_size, chunk_size)
     yield output_chunks
 
 
-if __name__=="__main__":
-    (args, input_from_stdin, output_to_stdout) = get_commandline_args()
+def write_sequence_range(open_fastq_file, output, minimum_size, maximum_size, chunk_size,
+                         queue_depth=QUEUE_DEPTH):
+    """Write fastq reads within the size range to output, overlapping reading,
+    filtering and writing when queue_depth is above 0."""
+    with BackgroundWriter(output, queue_depth) as writer:
+        for group in keep_sequence_range(open_fastq_file, minimum_size, maximum_size, chunk_size,
+                                         queue_depth):
+            writer.write(group)
+
+
+def main(argv=None):
+    """Run keep_sequence_range.py with command-line arguments argv (default: sys.argv[1:])."""
+    (args, input_from_stdin, output_to_stdout) = get_commandline_args(argv)
     try:
-        if input_from_stdin:
-            in_file = sys.stdin
-            for group in keep_sequence_range(in_file, args.minimum, args.maximum, CHUNK):
-                if output_to_stdout:
-                    print group.strip()
-                else:
-                    with open(args.output, 'a') as output:
-                        output.write(group)
+        if output_to_stdout:
+            out_file = sys.stdout
         else:
-            with open(args.input) as in_file:
-                for group in keep_sequence_range(in_file, args.minimum, args.maximum, CHUNK):
-                    if output_to_stdout:
-                        print group.strip()
-                    else:
-                        with open(args.output, 'a') as output:
-                            output.write(group)
+            out_file = open(args.output, 'a')
+        try:
+            if input_from_stdin:
+                in_file = sys.stdin
+                write_sequence_range(in_file, out_file, args.minimum, args.maximum, CHUNK, args.queue_depth)
+            else:
+                with open(args.input) as in_file:
+                    write_sequence_range(in_file, out_file, args.minimum, args.maximum, CHUNK, args.queue_depth)
+        finally:
+            if not output_to_stdout:
+                out_file.close()
     except IOError as error:
         sys.stderr.write("Could not open file: {}\n".format(error.filename))
         sys.stderr.flush()
         raise IOError(error)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,10 @@ Copyright (C) 2014 Joy-El R.B. Talbot
 For details on Bowtie please see their website:
     http://bowtie-bio.sourceforge.net/index.shtml"""
 
+import sys
 from commonIO import read_chunk
+from commonIO import CustomParser
+from commonIO import BackgroundWriter
 
 
 def add_multimapping_tally(open_bowtie_file, chunk_size=2048):
@@ -34,11 +37,18 @@ def add_multimapping_tally(open_bowtie_file, chunk_size=2048):
             samtools view -S bowtiefile.sam | sort -k1,1 >> sortedbowtiefile.sam
     Note that sorting may take a lot of resource to do, that's why it is best
     to add multimapping tally BEFORE any other operations are done to the
-    Bowtie output."""
+    Bowtie output.
+    Header lines (starting with @) are passed through unchanged and blank
+    lines are skipped."""
     master_read = ""
     mapping_count = 0
     saved_reads = []
     for alignment in read_chunk(open_bowtie_file, chunk_size):
+        if not alignment:
+            continue
+        if alignment[0] == "@":
+            yield alignment
+            continue
         columns = alignment.split("\t")
         if columns[0] == master_read:
             mapping_count += 1
@@ -55,5 +65,56 @@ def add_multimapping_tally(open_bowtie_file, chunk_size=2048):
             else:
                 # mapped read
                 mapping_count = 1
+    # tally the final read
+    for read in saved_reads:
+        yield "{}\tNH:i:{}".format(read, mapping_count)
 
 
+def get_commandline_args(argv=None):
+    """Command-line interface for add_multimapping_tally"""
+    parser = CustomParser(
+        description='''parse_bowtie_output.py adds an NH:i: tag with the number of mappings
+of each read to Bowtie output in SAM format (sorted by read name).
+
+Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument("-i", "--input",
+                        help="bowtie file (SAM format), omit to read from commandline",
+                        metavar="SAM")
+    parser.add_argument("-o", "--output",
+                        help="name of output file, omit to write to commandline",
+                        metavar="OUT")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run add_multimapping_tally with command-line arguments argv (default: sys.argv[1:])."""
+    args = get_commandline_args(argv)
+    try:
+        if args.output is None:
+            out_file = sys.stdout
+        else:
+            out_file = open(args.output, "a")
+        try:
+            if args.input is None:
+                in_file = sys.stdin
+            else:
+                in_file = open(args.input)
+            try:
+                with BackgroundWriter(out_file) as writer:
+                    for alignment in add_multimapping_tally(in_file):
+                        writer.write(alignment + "\n")
+            finally:
+                if args.input is not None:
+                    in_file.close()
+        finally:
+            if args.output is not None:
+                out_file.close()
+    except IOError as error:
+        sys.stderr.write("Could not open file: {}\n".format(error.filename))
+        sys.stderr.flush()
+        raise IOError(error)
+
+
+if __name__ == "__main__":
+    main()
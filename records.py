@@ -0,0 +1,360 @@
+"""records.py is the library interface to the SequenceTools parsers: typed,
+compact records for SAM alignments, BED intervals and FASTQ reads, read from
+and written to binary files as bytes, with iterator-based transformations.
+All parsing state belongs to a stream object, so several streams can be
+parsed at once (e.g. in threads). Works with Python 2.7 and Python 3.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>
+
+Example:
+    with open("reads.sam", "rb") as alignments, open("5prime.bed", "wb") as output:
+        write_records(five_prime_bases(AlignmentStream(alignments)), output)"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import re
+from collections import namedtuple
+from commonIO import read_chunk
+from chromosomes import ChromosomeDictionary
+
+CHUNK_SIZE = 65536  # bytes of input read per IO call
+WRITE_BATCH = 1024  # records joined into a single write by write_records
+UNMAPPED = 0x4  # SAM flag bits
+ANTISENSE = 0x10
+MD_CACHE_SIZE = 100000  # distinct MD strings remembered by count_md_mismatches
+
+_CIGAR_ENTRY = re.compile(br'(\d+)([MIDNSHP=X])')
+_CIGAR_COUNTED = frozenset([b'M', b'=', b'X'])  # consume read and reference bases
+_CIGAR_ADVANCED = frozenset([b'D', b'N', b'P'])  # consume reference bases only
+_STRANDS = {b'+': b'+', b'-': b'-', b'.': b'.'}
+# a deleted run (^ and its bases, captured) or one mismatched base, for bytes and str MD strings
+_MD_BASES = re.compile(br'(\^[A-Za-z]*)|[A-Za-z]')
+_MD_BASES_TEXT = re.compile(r'(\^[A-Za-z]*)|[A-Za-z]')
+
+_md_mismatch_cache = {}
+
+
+class RecordError(Exception):
+    """Record parsing error."""
+    def __init__(self, message, name='general'):
+        self.message = message
+        self.name = name
+
+    def __str__(self):
+        return 'RecordError - {}: {}'.format(self.name, self.message)
+
+
+def _number(value):
+    """Return an integer as bytes."""
+    return str(value).encode('ascii')
+
+
+def count_md_mismatches(md_string):
+    """Return the number of mismatched bases in an MD string (deleted ^ bases are not counted).
+
+    md_string may be bytes or str. Results are cached per distinct MD string."""
+    try:
+        return _md_mismatch_cache[md_string]
+    except KeyError:
+        pass
+    if isinstance(md_string, bytes):
+        md_bases = _MD_BASES
+    else:
+        md_bases = _MD_BASES_TEXT
+    mismatches = 0
+    for deletion in md_bases.findall(md_string):
+        if not deletion:
+            mismatches += 1
+    if len(_md_mismatch_cache) >= MD_CACHE_SIZE:
+        _md_mismatch_cache.clear()
+    _md_mismatch_cache[md_string] = mismatches
+    return mismatches
+
+
+def get_mismatches(flags):
+    """Return number of mismatches from the NM flag, or from the MD flag when
+    there is no NM flag, or None. See SAM format for details.
+
+    NM is the edit distance, so it also counts inserted and deleted bases;
+    the MD count covers mismatched bases only. flags may be bytes or str."""
+    if not flags:
+        return None
+    if isinstance(flags[0], bytes):
+        (nm_flag, md_flag) = (b"NM:i:", b"MD:Z:")
+    else:
+        (nm_flag, md_flag) = ("NM:i:", "MD:Z:")
+    md_string = None
+    for flag in flags:
+        if flag.startswith(nm_flag):
+            return int(flag[5:])
+        elif flag.startswith(md_flag):
+            md_string = flag[5:]
+    if md_string is not None:
+        return count_md_mismatches(md_string)
+
+
+def cigar_positions(cigar, start, sequence_length):
+    """Return the 0-based reference positions covered by the bases of an alignment."""
+    if cigar == b'*':
+        return list(range(start, start + sequence_length))
+    positions = []
+    current_position = start
+    for (length, code) in _CIGAR_ENTRY.findall(cigar):
+        length = int(length)
+        if code in _CIGAR_COUNTED:
+            positions.extend(range(current_position, current_position + length))
+            current_position += length
+        elif code in _CIGAR_ADVANCED:
+            current_position += length
+    return positions
+
+
+class SAMAlignment(namedtuple('SAMAlignment', ['name', 'flag', 'chromosome', 'position', 'mapq', 'cigar',
+                                               'mate_chromosome', 'mate_position', 'template_length',
+                                               'sequence', 'quality', 'tags'])):
+    """One SAM alignment. flag and position (1-based) are integers, tags is a
+    tuple of the optional fields and all other fields are bytes."""
+    __slots__ = ()
+
+    @classmethod
+    def from_bytes(cls, line, chromosomes=None):
+        """Parse a SAM alignment line; chromosome names of mapped alignments are
+        interned if a ChromosomeDictionary is given."""
+        fields = line.split(b'\t')
+        if len(fields) < 11:
+            raise RecordError('Not a SAM alignment: {!r}'.format(line), 'SAM')
+        flag = int(fields[1])
+        chromosome = fields[2]
+        if chromosomes is not None and not flag & UNMAPPED:
+            chromosome = chromosomes.intern(chromosome)
+        return cls(fields[0], flag, chromosome, int(fields[3]), fields[4], fields[5],
+                   fields[6], fields[7], fields[8], fields[9], fields[10], tuple(fields[11:]))
+
+    def to_bytes(self):
+        """Return the alignment as a SAM line (without newline)."""
+        return b'\t'.join((self.name, _number(self.flag), self.chromosome, _number(self.position), self.mapq,
+                           self.cigar, self.mate_chromosome, self.mate_position, self.template_length,
+                           self.sequence, self.quality) + self.tags)
+
+    @property
+    def mapped(self):
+        return not self.flag & UNMAPPED
+
+    @property
+    def strand(self):
+        return b'-' if self.flag & ANTISENSE else b'+'
+
+    @property
+    def start(self):
+        """0-based leftmost reference position."""
+        return self.position - 1
+
+    def mismatches(self):
+        """Return the number of mismatches (see get_mismatches)."""
+        return get_mismatches(self.tags)
+
+    def positions(self):
+        """Return the 0-based reference positions from the 5' to the 3' end of the read."""
+        positions = cigar_positions(self.cigar, self.start, len(self.sequence))
+        if self.flag & ANTISENSE:
+            positions.reverse()
+        return positions
+
+    def to_bed(self):
+        """Return the alignment as a BEDInterval spanning its 5' to 3' positions."""
+        positions = self.positions()
+        return BEDInterval(self.chromosome, positions[0], positions[-1] + 1, self.name, b'0', self.strand)
+
+    def first_base(self):
+        """Return the 5'-most base of the alignment as a BEDInterval."""
+        first = self.positions()[0]
+        return BEDInterval(self.chromosome, first, first + 1, self.name, b'0', self.strand)
+
+
+class BEDInterval(namedtuple('BEDInterval', ['chromosome', 'start', 'end', 'name', 'score', 'strand'])):
+    """One BED6 interval. start (0-based) and end (1-based) are integers and all
+    other fields are bytes."""
+    __slots__ = ()
+
+    @classmethod
+    def from_bytes(cls, line, chromosomes=None):
+        """Parse a BED line (at least 3 columns); chromosome names are interned if a ChromosomeDictionary is given."""
+        fields = line.split(b'\t')
+        if len(fields) < 3:
+            raise RecordError('Not a BED interval: {!r}'.format(line), 'BED')
+        chromosome = fields[0]
+        if chromosomes is not None:
+            chromosome = chromosomes.intern(chromosome)
+        name = fields[3] if len(fields) > 3 else b'.'
+        score = fields[4] if len(fields) > 4 else b'0'
+        strand = _STRANDS.get(fields[5], fields[5]) if len(fields) > 5 else b'.'
+        return cls(chromosome, int(fields[1]), int(fields[2]), name, score, strand)
+
+    def to_bytes(self):
+        """Return the interval as a BED6 line (without newline)."""
+        return b'\t'.join((self.chromosome, _number(self.start), _number(self.end), self.name, self.score,
+                           self.strand))
+
+    @property
+    def mapped(self):
+        return True
+
+    def positions(self):
+        """Return the 0-based positions from the 5' to the 3' end ('+' unless the strand is '-')."""
+        if self.strand == b'-':
+            return list(range(self.end - 1, self.start - 1, -1))
+        else:
+            return list(range(self.start, self.end))
+
+    def to_bed(self):
+        return self
+
+    def first_base(self):
+        """Return the 5'-most base of the interval as a BEDInterval."""
+        first = self.positions()[0]
+        return BEDInterval(self.chromosome, first, first + 1, self.name, b'0', self.strand)
+
+
+class FastqRecord(namedtuple('FastqRecord', ['name', 'sequence', 'description', 'quality'])):
+    """One 4-line FASTQ read; name excludes the leading @ and description is
+    the text after the + line's +. All fields are bytes."""
+    __slots__ = ()
+
+    def to_bytes(self):
+        """Return the read as 4 FASTQ lines (without final newline)."""
+        return b''.join((b'@', self.name, b'\n', self.sequence, b'\n+', self.description, b'\n', self.quality))
+
+
+def iter_lines(source, chunk_size=CHUNK_SIZE):
+    """Yield the lines (bytes, without newlines) of a binary file object or of an iterable of lines."""
+    if hasattr(source, 'read'):
+        for line in read_chunk(source, chunk_size):
+            yield line
+    else:
+        for line in source:
+            yield line.rstrip(b'\r\n')
+
+
+def detect_format(line):
+    """Return 'SAM' or 'BED' for an alignment line (bytes)."""
+    fields = line.split(b'\t')
+    if len(fields) >= 11 and fields[1].isdigit() and fields[3].isdigit():
+        return 'SAM'
+    elif len(fields) >= 3 and fields[1].isdigit() and fields[2].isdigit():
+        return 'BED'
+    raise RecordError('Could not determine the format of: {!r}'.format(line), 'format')
+
+
+class AlignmentStream(object):
+    """Iterate over the SAMAlignment or BEDInterval records of one source,
+    detecting SAM vs. BED from the first record unless input_format is given.
+
+    The detected format, SAM header lines and chromosome dictionary are kept
+    on the instance. Unmapped SAM alignments are included (see the mapped
+    property); comment lines (#) and blank lines are skipped."""
+    def __init__(self, source, input_format=None, chunk_size=CHUNK_SIZE):
+        self.source = source
+        self.input_format = input_format
+        self.chunk_size = chunk_size
+        self.headers = []
+        self.chromosomes = ChromosomeDictionary()
+
+    def add_header(self, line):
+        """Keep a SAM header line, adding @SQ chromosomes to the chromosome dictionary."""
+        self.headers.append(line)
+        self.chromosomes.add_sam_header(line)
+
+    def __iter__(self):
+        chromosomes = self.chromosomes
+        parse = None
+        for line in iter_lines(self.source, self.chunk_size):
+            if not line or line[:1] == b'#':
+                continue
+            if line[:1] == b'@':
+                self.add_header(line)
+                continue
+            if parse is None:
+                if self.input_format is None:
+                    self.input_format = detect_format(line)
+                parse = PARSERS[self.input_format]
+            yield parse(line, chromosomes)
+
+
+PARSERS = {'SAM': SAMAlignment.from_bytes, 'BED': BEDInterval.from_bytes}
+
+
+def iter_sam(source, chunk_size=CHUNK_SIZE):
+    """Yield SAMAlignment records from a binary SAM file object or iterable of lines."""
+    return iter(AlignmentStream(source, 'SAM', chunk_size))
+
+
+def iter_bed(source, chunk_size=CHUNK_SIZE):
+    """Yield BEDInterval records from a binary BED file object or iterable of lines."""
+    return iter(AlignmentStream(source, 'BED', chunk_size))
+
+
+def iter_fastq(source, chunk_size=CHUNK_SIZE):
+    """Yield FastqRecord records from a binary FASTQ file object or iterable of lines.
+
+    DOES NOT WORK WITH MULTI-LINE SEQUENCE FASTQ FILES!!"""
+    lines = iter_lines(source, chunk_size)
+    for header in lines:
+        if not header:
+            continue
+        try:
+            sequence = next(lines)
+            separator = next(lines)
+            quality = next(lines)
+        except StopIteration:
+            raise RecordError('Incomplete FASTQ record: {!r}'.format(header), 'FASTQ')
+        if header[:1] != b'@' or separator[:1] != b'+':
+            raise RecordError('Not a FASTQ record: {!r}'.format(header), 'FASTQ')
+        yield FastqRecord(header[1:], sequence, separator[1:], quality)
+
+
+def five_prime_bases(alignments):
+    """Yield the 5'-most base of each mapped alignment as a BEDInterval
+    (the library form of extract_5prime_most_base.py)."""
+    for alignment in alignments:
+        if alignment.mapped:
+            yield alignment.first_base()
+
+
+def filter_length(reads, minimum_size=16, maximum_size=35):
+    """Yield the FASTQ reads whose length is within the size range
+    (the library form of keep_sequence_range.py)."""
+    for read in reads:
+        if minimum_size <= len(read.sequence) <= maximum_size:
+            yield read
+
+
+def write_records(records, output, batch_size=WRITE_BATCH):
+    """Write records to a binary file object, one line (or FASTQ record) each,
+    joining batch_size records per write call. Returns the number written."""
+    written = 0
+    batch = []
+    for record in records:
+        batch.append(record.to_bytes())
+        if len(batch) >= batch_size:
+            batch.append(b'')
+            output.write(b'\n'.join(batch))
+            written += len(batch) - 1
+            batch = []
+    if batch:
+        batch.append(b'')
+        output.write(b'\n'.join(batch))
+        written += len(batch) - 1
+    return written
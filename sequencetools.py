@@ -0,0 +1,123 @@
+#!/usr/bin/python
+"""sequencetools.py runs any SequenceTools script as a subcommand, importing
+only the module the subcommand needs, and can run a manifest of many
+commands in one process or a pool of worker processes.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>
+
+Usage:
+    sequencetools COMMAND [ARGUMENTS]
+    sequencetools batch MANIFEST [WORKERS]
+
+A manifest has one command per line (e.g. "extract5p -i bin_1.sam -o bin_1.bed");
+blank lines and lines starting with # are skipped. Give every command its own
+input and output files when running with more than one worker."""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import shlex
+import sys
+
+# subcommand -> module whose main(argv) runs it; modules are imported on first use
+COMMANDS = {'extract5p': 'extract_5prime_most_base',
+            'alignment-db': 'create_alignment_db',
+            'clusters': 'create_cluster_files',
+            'cluster-summary': 'summarize_clusters',
+            'filter-length': 'keep_sequence_range',
+            'split': 'split_by_position',
+            'nh-tally': 'parse_bowtie_output'}
+
+
+def usage():
+    """Return the help message."""
+    return '{}\n\nCommands:\n{}\n'.format(
+        __doc__[__doc__.index('Usage:'):],
+        '\n'.join('    {:<17}{}.py'.format(command, COMMANDS[command]) for command in sorted(COMMANDS)))
+
+
+def run_command(argv):
+    """Run one subcommand given as an argument list; returns its exit status."""
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write('error: unknown command: {}\n{}'.format(' '.join(argv), usage()))
+        return 2
+    module = __import__(COMMANDS[argv[0]])
+    try:
+        module.main(argv[1:])
+    except SystemExit as exit_:
+        if exit_.code is None:
+            return 0
+        elif isinstance(exit_.code, int):
+            return exit_.code
+        return 1
+    return 0
+
+
+def _run_manifest_line(line):
+    """Worker: run one manifest line, reporting (line, exit status)."""
+    try:
+        status = run_command(shlex.split(line))
+    except Exception as error:
+        sys.stderr.write('error: {}: {}\n'.format(line, error))
+        sys.stderr.flush()
+        status = 1
+    return line, status
+
+
+def read_manifest(manifest_filename):
+    """Return the command lines of a manifest file."""
+    with open(manifest_filename) as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.lstrip().startswith('#')]
+
+
+def run_batch(manifest_filename, workers=1):
+    """Run every command in a manifest, in this process or across a pool of workers.
+
+    Returns the number of commands that failed."""
+    commands = read_manifest(manifest_filename)
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_run_manifest_line, commands, 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_manifest_line(command) for command in commands]
+    failures = 0
+    for (command, status) in results:
+        if status != 0:
+            sys.stderr.write('Failed ({}): {}\n'.format(status, command))
+            failures += 1
+    sys.stderr.write('Ran {} commands, {} failed.\n'.format(len(results), failures))
+    sys.stderr.flush()
+    return failures
+
+
+def main(argv=None):
+    """Run sequencetools.py with command-line arguments argv (default: sys.argv[1:])."""
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h', '--help'):
+        sys.stdout.write(usage())
+        return 0
+    if argv[0] == 'batch':
+        if len(argv) not in (2, 3) or (len(argv) == 3 and not argv[2].isdigit()):
+            sys.stderr.write('error: batch takes a manifest file and an optional worker count\n{}'.format(usage()))
+            return 2
+        workers = int(argv[2]) if len(argv) == 3 else 1
+        return 1 if run_batch(argv[1], workers) else 0
+    return run_command(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""Installs the SequenceTools scripts and the sequencetools command."""
+from setuptools import setup
+
+setup(name='SequenceTools',
+      version='0.1.0',
+      description='Objects and functions to manipulate sequence, alignment and annotation files',
+      author='Joy-El R.B. Talbot',
+      url='https://github.com/Joy-El/SequenceTools/',
+      license='GPLv3',
+      py_modules=['chromosomes',
+                  'commonIO',
+                  'create_alignment_db',
+                  'create_cluster_files',
+                  'extract_5prime_most_base',
+                  'keep_sequence_range',
+                  'parse_bowtie_output',
+                  'records',
+                  'sequencetools',
+                  'split_by_position',
+                  'summarize_clusters'],
+      entry_points={'console_scripts': ['sequencetools = sequencetools:main']})
@@ -19,24 +19,91 @@ Copyright (C) 2014 Joy-El R.B. Talbot
 __author__ = 'Joy-El R.B. Talbot'
 
 from commonIO import read_chunk
+from commonIO import CustomParser
+from chromosomes import ChromosomeDictionary
 import sys
 
 ##TODO speed this up or implement a bash pipeline. Right now it is WAY too slow...
 
 CHUNK = 4096  # bytes of input read per IO call with read_chunk
 SPLIT = 10000000  # bases per unit
+OPEN_FILES = 64  # output files kept open at once
 
 
-def split_by_position(bed_like_file, base_chunk):
+def get_commandline_args(argv=None):
+    """Command-line interface for split_by_position.py"""
+    parser = CustomParser(
+        description='''split_by_position.py splits a BED-like file by chromosome and start position
+into files named CHROMOSOME_BIN in the current directory.
+
+Copyright (C) 2014 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument("-i", "--input",
+                        help="BED-like file, omit to read from commandline",
+                        metavar="BED")
+    parser.add_argument("-s", "--split",
+                        help="bases per output file, default = {}".format(SPLIT),
+                        metavar="BASES",
+                        type=int,
+                        default=SPLIT)
+    parser.add_argument("-d", "--database_prefix",
+                        help="Prefix of a chromosome dictionary ({prefix}_chromosomes.data) to share and extend; "
+                             "parallel jobs adding new chromosomes to one prefix are not merged",
+                        metavar="NAME",
+                        type=str)
+    return parser.parse_args(argv)
+
+
+def split_by_position(bed_like_file, base_chunk, chromosomes=None):
     """Split a file into several subfiles by chromosome and start position.
+
+    Up to OPEN_FILES output files are kept open between lines; chromosome
+    names are interned through a ChromosomeDictionary, which is returned.
     """
-    for line in read_chunk(bed_like_file, CHUNK):
-        parts = line.split("\t")
-        outfile_name = "{}_{}".format(parts[0], (int(parts[1]) / base_chunk))
-        with open(outfile_name, 'a') as outfile:
+    if chromosomes is None:
+        chromosomes = ChromosomeDictionary()
+    outfiles = {}  # (chromosome, bin) -> open output file
+    try:
+        for line in read_chunk(bed_like_file, CHUNK):
+            parts = line.split("\t")
+            outfile_key = (chromosomes.intern(parts[0]), int(parts[1]) // base_chunk)
+            try:
+                outfile = outfiles[outfile_key]
+            except KeyError:
+                if len(outfiles) >= OPEN_FILES:
+                    for open_outfile in outfiles.values():
+                        open_outfile.close()
+                    outfiles = {}
+                outfile = open("{}_{}".format(*outfile_key), 'a')
+                outfiles[outfile_key] = outfile
             outfile.write(line + "\n")
+    finally:
+        for open_outfile in outfiles.values():
+            open_outfile.close()
+    return chromosomes
+
+
+def main(argv=None):
+    """Run split_by_position.py with command-line arguments argv (default: sys.argv[1:])."""
+    args = get_commandline_args(argv)
+    if args.database_prefix is None:
+        chromosome_db = ChromosomeDictionary()
+    else:
+        chromosome_db = ChromosomeDictionary.load(args.database_prefix)
+    try:
+        if args.input is None:
+            infile = sys.stdin
+            split_by_position(infile, args.split, chromosome_db)
+        else:
+            with open(args.input) as infile:
+                split_by_position(infile, args.split, chromosome_db)
+    except IOError as error:
+        sys.stderr.write("Could not open file: {}\n".format(error.filename))
+        sys.stderr.flush()
+        raise IOError(error)
+    if args.database_prefix is not None:
+        chromosome_db.save(args.database_prefix)
 
 
 if __name__ == "__main__":
-    infile = sys.stdin
-    split_by_position(infile, SPLIT)
\ No newline at end of file
+    main()
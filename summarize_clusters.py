@@ -0,0 +1,292 @@
+#!/usr/bin/python
+"""summarize_clusters.py joins sorted tag loci to sorted clusters in one
+streaming pass and writes per-cluster totals: alignments, multimapping-weighted
+reads, unique tags, mismatch histogram and strand bias.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>
+
+Both inputs must be sorted by chromosome (byte order), then start position, e.g.
+    LC_ALL=C sort -k1,1 -k2,2n {prefix}_tagloci.data > {prefix}_tagloci.sorted.data
+    LC_ALL=C sort -k1,1 -k2,2n {prefix}_clusters.data > {prefix}_clusters.sorted.data
+
+Memory is bounded by the clusters open at one position. Weighted reads are
+opt-in (--tags {prefix}_tags.data): they need the mappings of every tag, which
+are held in memory whole, so memory then grows with the library."""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import sys
+from commonIO import CustomParser
+from commonIO import BackgroundWriter
+from commonIO import read_lines
+from commonIO import QUEUE_DEPTH
+from create_cluster_files import UniqueTags
+from create_cluster_files import TAG_MEMORY
+from create_alignment_db import MISMATCH_BINS
+
+CHUNK = 4096  # bytes of input read per IO call with read_chunk
+
+
+class ClusterSummary(object):
+    """Running totals of the tag loci assigned to one cluster."""
+
+    __slots__ = ['name', 'chromosome', 'start', 'end', 'strand', 'alignments', 'weighted_reads',
+                 'mismatch_tally', 'plus_alignments', 'minus_alignments', 'tags']
+
+    def __init__(self, name, chromosome, start, end, strand, mismatch_bins=MISMATCH_BINS, tag_memory=TAG_MEMORY):
+        self.name = name
+        self.chromosome = chromosome
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.alignments = 0
+        self.weighted_reads = 0.0
+        self.mismatch_tally = [0] * mismatch_bins
+        self.plus_alignments = 0
+        self.minus_alignments = 0
+        self.tags = UniqueTags(tag_memory)
+
+    def contains(self, start, end, strand):
+        """Return True if a tag locus lies within the cluster on a compatible strand."""
+        return (self.start <= start and end <= self.end and
+                (self.strand == "." or strand == "." or self.strand == strand))
+
+    def add(self, tag, mismatches, strand, mappings):
+        """Add one tag locus (one alignment of one read) to the totals."""
+        self.alignments += 1
+        if mappings:
+            self.weighted_reads += 1.0 / mappings
+        self.mismatch_tally[min(mismatches, len(self.mismatch_tally) - 1)] += 1
+        if strand == "+":
+            self.plus_alignments += 1
+        elif strand == "-":
+            self.minus_alignments += 1
+        self.tags.add(tag)
+
+    def summary(self):
+        """Return the summary row (without newline) and release the cluster's tags."""
+        unique_tags = sum(1 for _ in self.tags.unique())
+        self.tags.close()
+        stranded = self.plus_alignments + self.minus_alignments
+        if stranded:
+            strand_bias = "{:.4f}".format(float(self.plus_alignments) / stranded)
+        else:
+            strand_bias = "NA"
+        return "\t".join([self.chromosome, str(self.start), str(self.end), self.name, self.strand,
+                          str(self.alignments), "{:.4f}".format(self.weighted_reads), str(unique_tags)] +
+                         [str(m) for m in self.mismatch_tally] +
+                         [str(self.plus_alignments), str(self.minus_alignments), strand_bias])
+
+
+def read_mappings(tags_openfile):
+    """Return a dictionary of tag sequence to number of mappings from a {prefix}_tags.data file.
+
+    The dictionary covers the whole genome, so its size grows with the number
+    of distinct tags (millions for a deep library) and is not bounded per
+    chromosome like the rest of summarize_clusters."""
+    mappings = {}
+    for line in read_lines(tags_openfile, CHUNK, 0):
+        if line:
+            parts = line.split("\t", 2)
+            mappings[parts[0]] = int(parts[1])
+    return mappings
+
+
+def check_order(kind, last_position, position):
+    """Raise a ValueError if (chromosome, start) positions are not sorted."""
+    if last_position is not None and position < last_position:
+        raise ValueError("{} file is not sorted by chromosome and start (LC_ALL=C sort -k1,1 -k2,2n): "
+                         "{}:{} follows {}:{}".format(kind, position[0], position[1],
+                                                      last_position[0], last_position[1]))
+
+
+def summarize_clusters(tagloci_openfile, clusters_openfile, output, mappings=None,
+                       mismatch_bins=MISMATCH_BINS, tag_memory=TAG_MEMORY, queue_depth=QUEUE_DEPTH):
+    """Assign each tag locus to its cluster with a sweep over start positions and
+    write one summary row per cluster to output.
+
+    Inputs are a sorted {prefix}_tagloci.data file (chromosome, start, end, tag,
+    mismatches, strand) and a sorted {prefix}_clusters.data file (chromosome,
+    start, end, cluster_name, tags, strand). Only clusters overlapping the
+    current tag locus are held in memory, plus the mappings dictionary if one
+    is given (see read_mappings: one entry per distinct tag in the library).
+    Without a mappings dictionary weighted reads are 0.
+
+    Summary rows ({prefix}_clustersummary.data):
+        Chromosome,
+        Start (0-based),
+        End,
+        cluster_name,
+        Strand (+,-,or .),
+        Alignments (tag loci in the cluster),
+        Weighted reads (each alignment counts 1/mappings of its read),
+        Unique tags,
+        Alignments with 0, 1, ... mismatch_bins - 1 or more mismatches,
+        Alignments on the + strand,
+        Alignments on the - strand,
+        Strand bias (fraction of stranded alignments on +, NA if none)
+
+    Returns (tag loci assigned to a cluster, tag loci outside all clusters)."""
+    if mappings is None:
+        mappings = {}
+    clusters = read_lines(clusters_openfile, CHUNK, queue_depth)
+    assigned = 0
+    unassigned = 0
+    active = []  # clusters overlapping the current position, in start order
+    last_locus = None
+    last_cluster = None
+
+    def read_next_cluster():
+        """Return the next cluster as (chromosome, start, end, name, strand) or None at the end."""
+        for line in clusters:
+            if line:
+                parts = line.split("\t")
+                strand = parts[5] if len(parts) > 5 else "."
+                return parts[0], int(parts[1]), int(parts[2]), parts[3], strand
+        return None
+
+    with BackgroundWriter(output, queue_depth) as writer:
+        next_cluster = read_next_cluster()
+        for locus in read_lines(tagloci_openfile, CHUNK, queue_depth):
+            if not locus:
+                continue
+            (chromosome, start, end, tag, mismatches, strand) = locus.split("\t")
+            start = int(start)
+            check_order("Tag loci", last_locus, (chromosome, start))
+            if last_locus is None or chromosome != last_locus[0]:
+                # new chromosome: every open cluster is complete
+                for cluster in active:
+                    writer.write(cluster.summary() + "\n")
+                active = []
+            last_locus = (chromosome, start)
+
+            # bring in clusters that start at or before this locus (writing any on earlier chromosomes)
+            while next_cluster is not None and (next_cluster[0], next_cluster[1]) <= last_locus:
+                check_order("Clusters", last_cluster, next_cluster[:2])
+                last_cluster = next_cluster[:2]
+                cluster = ClusterSummary(next_cluster[3], next_cluster[0], next_cluster[1], next_cluster[2],
+                                         next_cluster[4], mismatch_bins, tag_memory)
+                if next_cluster[0] == chromosome:
+                    active.append(cluster)
+                else:
+                    writer.write(cluster.summary() + "\n")
+                next_cluster = read_next_cluster()
+
+            # retire clusters that end before this locus starts
+            if active and min(cluster.end for cluster in active) <= start:
+                for cluster in active:
+                    if cluster.end <= start:
+                        writer.write(cluster.summary() + "\n")
+                active = [cluster for cluster in active if cluster.end > start]
+
+            end = int(end)
+            for cluster in active:
+                if cluster.contains(start, end, strand):
+                    cluster.add(tag, int(mismatches), strand, mappings.get(tag, 0))
+                    assigned += 1
+                    break
+            else:
+                unassigned += 1
+
+        for cluster in active:
+            writer.write(cluster.summary() + "\n")
+        while next_cluster is not None:
+            check_order("Clusters", last_cluster, next_cluster[:2])
+            last_cluster = next_cluster[:2]
+            writer.write(ClusterSummary(next_cluster[3], next_cluster[0], next_cluster[1], next_cluster[2],
+                                        next_cluster[4], mismatch_bins, tag_memory).summary() + "\n")
+            next_cluster = read_next_cluster()
+    return assigned, unassigned
+
+
+def get_commandline_args(argv=None):
+    """Command-line interface for summarize_clusters.py"""
+    parser = CustomParser(
+        description='''summarize_clusters.py joins sorted tag loci to sorted clusters in one
+streaming pass and writes per-cluster totals to {prefix}_clustersummary.data.
+Sort both inputs first with: LC_ALL=C sort -k1,1 -k2,2n
+
+Copyright (C) 2015 Joy-El R.B. Talbot under the GNU General Public License version 3''')
+
+    parser.add_argument("-d", "--database_prefix",
+                        help="Prefix used by create_alignment_db.py and create_cluster_files.py",
+                        metavar="NAME",
+                        type=str,
+                        required=True)
+    parser.add_argument("-t", "--tagloci",
+                        help="sorted tag loci file, default = {prefix}_tagloci.data",
+                        metavar="TAGLOCI")
+    parser.add_argument("-c", "--clusters",
+                        help="sorted clusters file, default = {prefix}_clusters.data",
+                        metavar="CLUSTERS")
+    parser.add_argument("--tags",
+                        help="tags file (e.g. {prefix}_tags.data) giving the mappings per tag for weighted "
+                             "reads; it is loaded into memory whole (one entry per distinct tag), so memory "
+                             "grows with the library. Omit to keep memory bounded; weighted reads are then 0",
+                        metavar="TAGS")
+    parser.add_argument("--mismatch_bins",
+                        help="number of mismatch columns (0, 1, ... N-1 or more); "
+                             "default = {}".format(MISMATCH_BINS),
+                        metavar="N",
+                        type=int,
+                        default=MISMATCH_BINS)
+    parser.add_argument("--tag_memory",
+                        help="distinct tags per cluster kept in memory before spilling to temporary files; "
+                             "default = {}".format(TAG_MEMORY),
+                        metavar="TAGS",
+                        type=int,
+                        default=TAG_MEMORY)
+    parser.add_argument("--queue_depth",
+                        help="blocks buffered between the I/O threads and parsing, 0 disables threaded I/O; "
+                             "default = {}".format(QUEUE_DEPTH),
+                        metavar="BLOCKS",
+                        type=int,
+                        default=QUEUE_DEPTH)
+    arguments = parser.parse_args(argv)
+
+    if arguments.mismatch_bins < 1:
+        parser.error("--mismatch_bins must be at least 1")
+    if arguments.tag_memory < 1:
+        parser.error("--tag_memory must be at least 1")
+
+    if arguments.tagloci is None:
+        arguments.tagloci = "{}_tagloci.data".format(arguments.database_prefix)
+    if arguments.clusters is None:
+        arguments.clusters = "{}_clusters.data".format(arguments.database_prefix)
+
+    return arguments
+
+
+def main(argv=None):
+    """Run summarize_clusters.py with command-line arguments argv (default: sys.argv[1:])."""
+    args = get_commandline_args(argv)
+    try:
+        if args.tags is None:
+            mappings = {}
+        else:
+            with open(args.tags) as tags_file:
+                mappings = read_mappings(tags_file)
+        with open(args.tagloci) as tagloci_file, open(args.clusters) as clusters_file, \
+                open("{}_clustersummary.data".format(args.database_prefix), "a") as output:
+            (assigned, unassigned) = summarize_clusters(tagloci_file, clusters_file, output, mappings,
+                                                        args.mismatch_bins, args.tag_memory, args.queue_depth)
+    except IOError as error:
+        sys.stderr.write("Could not open file: {}\n".format(error.filename))
+        sys.stderr.flush()
+        raise IOError(error)
+    sys.stderr.write("Assigned {} tag loci to clusters; {} fell outside all clusters.\n".format(assigned,
+                                                                                              unassigned))
+    sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    main()
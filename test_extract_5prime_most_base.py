@@ -0,0 +1,95 @@
+#!/usr/bin/python
+"""test_extract_5prime_most_base.py checks that BEDBatchWriter output is
+byte-identical to Read.print_first_base and Read.__str__.
+Run directly (python test_extract_5prime_most_base.py) or with pytest.
+Copyright (C) 2015 Joy-El R.B. Talbot
+
+    This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+    License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+    later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+    warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with this program (LICENSE).
+    If not, see <http://www.gnu.org/licenses/>"""
+
+__author__ = 'Joy-El R.B. Talbot'
+
+import unittest
+from extract_5prime_most_base import BEDBatchWriter
+from extract_5prime_most_base import Read
+from extract_5prime_most_base import ReadFormat
+from generate_test_data import SyntheticData
+
+# (input line, description) pairs covering each branch of Read's BED output
+FORMAT_CASES = [('read1\t0\tchr1\t100\t255\t20M\t*\t0\t0\tACGTACGTACGTACGTACGT\tIIIIIIIIIIIIIIIIIIII\tXA:i:0',
+                 'SAM sense'),
+                ('read2\t16\tchr1\t100\t255\t20M\t*\t0\t0\tACGTACGTACGTACGTACGT\tIIIIIIIIIIIIIIIIIIII\tXA:i:0',
+                 'SAM antisense'),
+                ('read3\t0\tchr2\t5000\t255\t8M200N12M\t*\t0\t0\tACGTACGTACGTACGTACGT\tIIIIIIIIIIIIIIIIIIII',
+                 'SAM spliced sense'),
+                ('read4\t16\tchr2\t5000\t255\t2S6M1I3M200N8M\t*\t0\t0\tACGTACGTACGTACGTACGT\tIIIIIIIIIIIIIIIIIIII',
+                 'SAM spliced antisense'),
+                ('chr3\t10\t30\tread5\t0\t+', 'BED +'),
+                ('chr3\t10\t30\tread6\t0\t-', 'BED -'),
+                ('chr3\t10\t30\tread7\t0\t.', 'BED .')]
+SYNTHETIC_READS = 2000  # synthetic SAM and BED reads checked in addition to FORMAT_CASES
+
+
+def format_differences(reads, first_base_only):
+    """Return a description of each read whose BEDBatchWriter line differs from Read's own formatting."""
+    if first_base_only:
+        expected_line = Read.print_first_base
+    else:
+        expected_line = Read.__str__
+    formatted = BEDBatchWriter(None, first_base_only).format_batch(reads).split('\n')
+    differences = []
+    if formatted[-1] != '' or len(formatted) - 1 != len(reads):
+        differences.append('{} lines formatted for {} reads'.format(len(formatted) - 1, len(reads)))
+    for (read, line) in zip(reads, formatted):
+        if line != expected_line(read):
+            differences.append('{}: {!r} != {!r}'.format(read.name, line, expected_line(read)))
+    return differences
+
+
+class TestBEDBatchWriter(unittest.TestCase):
+    """BEDBatchWriter.format_batch against Read.print_first_base and Read.__str__."""
+
+    def check(self, reads):
+        for first_base_only in (True, False):
+            self.assertEqual(format_differences(reads, first_base_only), [])
+
+    def test_format_cases(self):
+        for (line, description) in FORMAT_CASES:
+            read = Read(line, ReadFormat())
+            for first_base_only in (True, False):
+                self.assertEqual(format_differences([read], first_base_only), [], description)
+
+    def test_synthetic_sam(self):
+        read_format = ReadFormat()
+        reads = [Read(line, read_format) for line in SyntheticData().sam_alignments(SYNTHETIC_READS)
+                 if (int(line.split('\t')[1]) & 0x4) == 0]
+        self.check(reads)
+
+    def test_synthetic_bed(self):
+        read_format = ReadFormat()
+        self.check([Read(line, read_format) for line in SyntheticData().bed_intervals(SYNTHETIC_READS)])
+
+    def test_batches(self):
+        output = []
+
+        class Output(object):
+            def write(self, string):
+                output.append(string)
+
+        reads = [Read(line, ReadFormat()) for (line, _) in FORMAT_CASES]
+        with BEDBatchWriter(Output(), batch_size=3) as writer:
+            for read in reads:
+                writer.write(read)
+        self.assertEqual(len(output), 3)
+        self.assertEqual(''.join(output), ''.join(read.print_first_base() + '\n' for read in reads))
+
+
+if __name__ == '__main__':
+    unittest.main()